@@ -1,92 +1,219 @@
-import pandas as pd
 from network import Network
+from batch import BatchRunner, get_batch_backend
+from journal import RunJournal, load_journal, load_journal_config, run_fingerprint
+import argparse
 import json
-from tqdm import tqdm
 import random
-from stats import get_statistics
-
-# Load config
-from config_loader import load_config, clear_network_config
-config = load_config()
-test_mode = config['test_mode']
-output_path = config['output_path']
-random_order = config['random_order']
-verbose = config['verbose']
-num_questions = config['num_questions']
-question_start = config['question_start']
-create_num_communities = config['create_num_communities']
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from stats import StatsAggregator
+from metrics import collector
+from tracer import tracer, span
+from dataset_loader import load_dataset
+from results_store import ResultsStore
+from run_context import RunContext
+from config_loader import clear_network_config
 
 
 # MAD-Community class
 class MADCommunity:
-    # Parse data from given CSV file
-    def parse_data(self, data_path: str) -> pd.DataFrame:
-        data = pd.read_csv(f"../data/{data_path}")
-        if random_order:
-            return data.sample(n=num_questions)
-        else:
-            return data[question_start:question_start+num_questions]
-        
-    
-    # Run MAD-Community on GPQA dataset
-    def run_gpqa(self) -> list:
-        # Get data
-        data = self.parse_data("gpqa_dataset/gpqa_main.csv")
+    def __init__(self, ctx: RunContext, resume: bool=False):
+        # Parse and validate the network once for the whole run
+        self.ctx = ctx
+        self.topology = ctx.topology
+
+        # Load progress from an earlier run of the same config and journal this one
+        self.progress = {}
+        self.journal = None
+        if ctx.journal_path:
+            fingerprint = run_fingerprint(ctx)
+            if resume:
+                journaled = load_journal_config(ctx.journal_path)
+                if journaled is not None and journaled != fingerprint:
+                    changed = sorted(key for key in fingerprint.keys() | journaled.keys() if fingerprint.get(key) != journaled.get(key))
+                    raise ValueError(f"Run journal {ctx.journal_path} was written with a different config ({', '.join(changed)}), "
+                                     f"resume with the same config or start a new run")
+                self.progress = load_journal(ctx.journal_path)
+            self.journal = RunJournal(ctx.journal_path, resume, fingerprint)
+
+        # Open the dataset index, building it on first use
+        self.dataset = load_dataset(ctx.dataset, ctx.dataset_path)
+
+
+    # Ids of the questions selected by the config
+    def select_ids(self) -> list:
+        if self.ctx.random_order:
+            return self.dataset.sample(self.ctx.num_questions, self.ctx.seed)
+        return self.dataset.select(self.ctx.question_start, self.ctx.num_questions)
+
 
-        # Init counters and responses for statistics
-        count_correct = 0
-        count_total = 0
-        response_stats = []
+    # Read only the given questions, or the selected ones, from the indexed dataset
+    def parse_data(self, ids: list=None) -> list:
+        return list(self.dataset.rows(self.select_ids() if ids is None else ids))
         
-        # GPQA Column indices
-        question_col_idx = data.columns.get_loc("Question") + 1
-        correct_col_idx = data.columns.get_loc("Correct Answer") + 1
-        incorrect1_col_idx = data.columns.get_loc("Incorrect Answer 1") + 1
-        incorrect2_col_idx = data.columns.get_loc("Incorrect Answer 2") + 1
-        incorrect3_col_idx = data.columns.get_loc("Incorrect Answer 3") + 1
-        canary_col_idx = data.columns.get_loc("Canary String") + 1
-
-        # Loop through questions and print TQDM progress bar
-        for row in tqdm(data.itertuples(), desc="Processing", total=len(data), ncols=100, bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]"):
-            question_id = row[canary_col_idx]
-            print(f"\n\n ########## QUESTION {count_total+1} {{{question_id}}} ##########" if verbose else "", end='')
-
-            # Format question and answer
-            question = row[question_col_idx]
-            choices = [row[correct_col_idx], row[incorrect1_col_idx], row[incorrect2_col_idx], row[incorrect3_col_idx]]
-            random.shuffle(choices)
-            correct_idx = choices.index(row[correct_col_idx])
-            question = {'question': question, 'choices': choices}
+
+    # Format question and answer with a shuffle seeded per question
+    def prepare_question(self, question_num: int, row: dict) -> tuple:
+        question_id = row['tag']
+        print(f"\n\n ########## QUESTION {question_num+1} {{{question_id}}} ##########" if self.ctx.verbose else "", end='')
+
+        # Reuse the choice order of a journaled question
+        saved = self.progress.get(row['id'])
+        if saved is not None:
+            choices, correct_idx = saved['choices'], saved['correct_idx']
+        else:
+            correct_choice = row['correct']
+            choices = [correct_choice] + row['incorrect']
+            random.Random(self.ctx.seed + row['id']).shuffle(choices)
+            correct_idx = choices.index(correct_choice)
+            if self.journal is not None:
+                self.journal.record_question(row['id'], question_id, choices, correct_idx)
+
+        question = {'id': row['id'], 'question': row['question'], 'choices': choices}
+        return question, correct_idx
+
+
+    # Build a question's network, restoring journaled communities and journaling new ones
+    def build_network(self, row_id: int, question: dict) -> Network:
+        network = Network(question, self.topology, self.ctx)
+        saved = self.progress.get(row_id)
+        if saved is not None:
+            network.restore(saved['nodes'])
+        if self.journal is not None:
+            network.on_node_complete = lambda index, chat_hist: self.journal.record_node(row_id, index, chat_hist)
+        return network
+
+
+    # Check the network's final answer
+    def check_answer(self, row_id: int, question: dict, correct_idx: int, all_responses: list) -> dict:
+        if self.journal is not None:
+            self.journal.record_judge(row_id, all_responses[-1])
+        ans_choice = all_responses[-1]['Answer']
+        correct = (correct_idx + 1 == ans_choice)
+        print(f"{'Correct!' if correct else 'Wrong!'} The answer is...\nOption {correct_idx + 1}: {question['choices'][correct_idx]}\n\n" if self.ctx.verbose else "", end='')
+        return {'correct_answer': correct_idx + 1, 'all_responses': all_responses}
+
+
+    # Run the network on a single question
+    def run_question(self, question_num: int, row: dict) -> dict:
+        with span("question", question=row['id'], tag=row['tag']):
+            question, correct_idx = self.prepare_question(question_num, row)
 
             # Get answer from network
-            network = Network(question)
+            network = self.build_network(row['id'], question)
             all_responses = network.run_network()
-            ans_choice = all_responses[-1]['Answer']
-            response_stats.append({'correct_answer': correct_idx + 1, 'all_responses': all_responses})
+            return self.check_answer(row['id'], question, correct_idx, all_responses)
+
+
+    # Run questions in a worker pool and yield (index, result) as they complete
+    def run_pool(self, rows: list):
+        with ThreadPoolExecutor(max_workers=max(1, self.ctx.max_concurrent_questions)) as executor:
+            futures = {executor.submit(self.run_question, i, row): i for i, row in rows}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+
+    # Run all questions one debate wave at a time through the batch backend and yield (index, result)
+    def run_batch(self, rows: list):
+        prepared = [self.prepare_question(i, row) for i, row in rows]
+        networks = [self.build_network(row['id'], question) for (_, row), (question, _) in zip(rows, prepared)]
+        for j, all_responses in BatchRunner(get_batch_backend(self.ctx), self.ctx).run(networks):
+            i, row = rows[j]
+            question, correct_idx = prepared[j]
+            yield i, self.check_answer(row['id'], question, correct_idx, all_responses)
+
+
+    # Yield (index, result) for questions finished in the journal, then run the rest
+    def run_questions(self, rows: list):
+        remaining = []
+        for i, row in enumerate(rows):
+            saved = self.progress.get(row['id'])
+            if saved is not None and saved['judge'] is not None:
+                all_responses = [saved['nodes'][j] for j in range(self.topology.num_communities)] + [saved['judge']]
+                yield i, {'correct_answer': saved['correct_idx'] + 1, 'all_responses': all_responses}
+            else:
+                remaining.append((i, row))
+
+        # Run remaining questions
+        yield from self.run_batch(remaining) if self.ctx.execution_mode == "batch" else self.run_pool(remaining)
+    
 
-            # Check if answer is correct
-            correct = (correct_idx + 1 == ans_choice)
-            print(f"{'Correct!' if correct else 'Wrong!'} The answer is...\nOption {correct_idx + 1}: {choices[correct_idx]}\n\n" if verbose else "", end='')
+    # Run MAD-Community on the configured dataset
+    def run_dataset(self, desc: str="Processing", ids: list=None, results_path: str=None) -> StatsAggregator:
+        from tqdm import tqdm
 
-            # Update correct/total statistics
-            count_correct += 1 if correct else 0
-            count_total += 1
+        # Get data
+        rows = self.parse_data(ids)
+
+        # Init running statistics and the columnar store of every response
+        stats = StatsAggregator(self.topology)
+        results = None
+        if self.ctx.save_results and not self.ctx.test_mode:
+            results_path = results_path or f"{self.ctx.output_path}{self.dataset.name}_results"
+            results = ResultsStore.create(results_path, self.topology, self.ctx.num_agents)
+
+        # Run questions and print TQDM progress bar as they complete, closing the journal even if the run fails
+        progress = tqdm(self.run_questions(rows), desc=desc, total=len(rows), ncols=100, bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]{postfix}")
+        try:
+            for i, result in progress:
+                # Update running statistics
+                stats.add(result['correct_answer'], result['all_responses'])
+                if results is not None:
+                    results.add(rows[i]['id'], result['correct_answer'], result['all_responses'])
+                summary = stats.summary()
+                progress.set_postfix_str(f"judge {summary['Judge_Percent']}%")
 
-            # Save correct count to JSON file
-            if not test_mode:
-                with open(f"{output_path}gpqa_main_output.json", 'w') as f:
-                    json.dump({'correct': count_correct, 'total': count_total}, f, indent=4)
+                # Save running statistics to JSON file
+                if not self.ctx.test_mode:
+                    with open(f"{self.ctx.output_path}{self.dataset.name}_output.json", 'w') as f:
+                        json.dump({'correct': stats.judge_score, 'total': stats.num_questions, **summary}, f, indent=4)
+        finally:
+            if self.journal is not None:
+                self.journal.close()
+
+        # Save the results store
+        if results is not None:
+            results.close()
         
-        # Return response statistics
-        return response_stats
+        # Return statistics for the whole run
+        return stats
 
 
 # Call MADCommunity class
 if __name__ == "__main__":
-    # Initialize MADCommunity and run GPQA
-    clear_network_config(create_num_communities)
-    gpqa = MADCommunity()
-    response_stats = gpqa.run_gpqa()
-    
-    # Log statistics
-    get_statistics(response_stats)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="LLM Multi-Agent Debate with Communities")
+    parser.add_argument("--config", help="config file to use instead of config/_config.json or MAD_CONFIG")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a config value, parsed as JSON (nested keys with dots, e.g. rate_limits.default.rpm=100)")
+    parser.add_argument("--resume", action="store_true", help="skip questions and communities completed in the run journal")
+    parser.add_argument("--dry-run", action="store_true", help="load the config, network and dataset index, then exit")
+    args = parser.parse_args()
+
+    # Build the run context
+    try:
+        ctx = RunContext.from_file(args.config, args.overrides)
+    except ValueError as e:
+        parser.error(str(e))
+    clear_network_config(ctx.create_num_communities)
+
+    # Parse the network so an invalid network config is reported before anything runs
+    try:
+        ctx.topology
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Check the network and dataset without touching the run journal
+    if args.dry_run:
+        dataset = load_dataset(ctx.dataset, ctx.dataset_path)
+        print(f"Config OK: {ctx.topology.num_communities} communities, {len(dataset)} questions in {dataset.name}")
+    else:
+        # Initialize MADCommunity and run the dataset
+        try:
+            mad = MADCommunity(ctx, args.resume)
+        except ValueError as e:
+            parser.error(str(e))
+        stats = mad.run_dataset()
+
+        # Log statistics and call metrics
+        stats.write_report(ctx)
+        collector.export()
+        tracer.export()
\ No newline at end of file
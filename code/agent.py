@@ -1,55 +1,52 @@
-from openai import OpenAI, OpenAIError
 import time
-import backoff
-from pydantic import BaseModel
-
-# Load config
-from config_loader import *
-config = load_config()
-test_mode = config['test_mode']
-sleep_time = config['sleep_time']
-chat_models = config['chat_models']
-agent_model_index = config['agent_model_index']
-judge_model_index = config['judge_model_index']
-comm_judge_temp = config['comm_judge_temp']
-
-# Agent response format
-class Format(BaseModel):
-    answer: int
-    reason: str
+from contextlib import nullcontext
+from response_cache import ResponseCache, get_response_cache, CacheMiss
+from llm_backend import get_llm_backend, response_format, LLMConfigError
+from history import render_history
+from metrics import track_call, note_retry, note_cache_hit
+from resilience import get_retry_budget, retry_budget_giveup, get_circuit_breaker, hedged_call, CircuitOpenError
+from scheduler import get_scheduler
+from tracer import span
+from config_loader import load_agent_meta_prompt, load_agent_user_prompt, load_judge_meta_prompt, load_judge_user_prompt
 
 
 # Agent class
 class Agent:
-    def __init__(self, name: str, question: dict, temperature: float=0.7):
+    def __init__(self, name: str, question: dict, ctx, temperature: float=0.7, node_name: str=''):
         self.name = name
+        self.node_name = node_name
         self.temperature = temperature
-        self.client = OpenAI()
+        self.ctx = ctx
         self.question = question
+        self.round_num = 0
+        self.priority = (0, 0)
+        self.network_seq = None
 
         # Agent specific initialization
-        self.model_name = chat_models[agent_model_index]
+        self.model_name = ctx.chat_models[ctx.agent_model_index]
         self.meta_prompt = load_agent_meta_prompt()
         self.user_prompt = load_agent_user_prompt()
 
     
-    # Format user prompt
-    def format_user_prompt(self, chat_hist: list) -> str:
+    # Format user prompt, under another agent name if given
+    def format_user_prompt(self, chat_hist: list, agent_name: str=None) -> str:
         # Add question and choices to user prompt
         question = self.question['question']
         choices = self.question['choices']
 
+        # Set agent or judge name, judges always see the full history
+        if isinstance(self, CommunityJudge):
+            agent_name = "Judge"
+            strategy = "full"
+        else:
+            agent_name = self.name if agent_name is None else agent_name
+            strategy = self.ctx.history_strategy
+
         # Add other agents' responses to user prompt
         if not chat_hist:
             other_responses = "No other agents have responded yet."
         else:
-            other_responses = "\n".join([f'{res["Name"]}: Chose {res["Answer"]} because "{res["Reason"]}"' for res in chat_hist])
-
-        # Set agent or judge name
-        if isinstance(self, CommunityJudge):
-            agent_name = "Judge"
-        else:
-            agent_name = self.name
+            other_responses = render_history(chat_hist, self.ctx, strategy)
         
         # Replace placeholders in user prompt
         replace_dict = {
@@ -64,64 +61,217 @@ class Agent:
         return self.user_prompt.format(**replace_dict)
     
 
-    # Query OpenAI API
-    @backoff.on_exception(backoff.expo, OpenAIError, max_tries=20, max_time=60)
-    def query(self, messages: list) -> str:
-        time.sleep(sleep_time)
-        try:
-            response = self.client.beta.chat.completions.parse(
-                model=self.model_name,
-                messages=messages,
-                temperature=self.temperature,
-                response_format=Format
-            )
-
-            # Extract output from response and return it
-            return response.choices[0].message.parsed
+    # Query the LLM backend for n samples, retrying API errors with backoff under the shared retry budget until the deadline
+    def query(self, messages: list, n: int=1, deadline: float=None) -> list:
+        import backoff
+        from openai import OpenAIError
+        max_time = self.ctx.ask_deadline if deadline is None else deadline - time.monotonic()
+        retry = backoff.on_exception(backoff.expo, OpenAIError, max_tries=self.ctx.max_query_tries, max_time=max_time,
+                                     giveup=retry_budget_giveup(self.ctx.max_query_tries, max_time), on_backoff=note_retry)
+        return retry(self.query_once)(messages, n)
+
+
+    # Send one request through the run's LLM backend, naming the community so the mock backend answers each one independently
+    def query_once(self, messages: list, n: int=1) -> list:
+        backend = get_llm_backend(self.ctx)
+        request = {**self.request_body(messages), "node": self.node_name}
+        with span("query", model=self.model_name, samples=n):
+            if n == 1:
+                return [backend.generate(request, self.ctx.call_deadline)]
+            return backend.generate_samples(request, n, self.ctx.call_deadline)
+
+
+    # Model, messages and temperature of a request
+    def request_body(self, messages: list) -> dict:
+        return {"model": self.model_name, "messages": messages, "temperature": self.temperature}
         
-        # Raise OpenAIError if there's an error
-        except OpenAIError as ai_err:
-            ai_response_msg = ai_err.body["message"]
-            raise OpenAIError(f"OpenAI Error: {ai_response_msg}")
+
+    # Query the LLM backend once per identical request of a sweep, going through the response cache
+    def cached_query(self, messages: list, sample_index: int, deadline: float=None) -> object:
+        return self.cached_samples(messages, [sample_index], deadline)[0]
+
+
+    # Query samples of the same messages with one request, once per identical request of a sweep
+    def cached_samples(self, messages: list, sample_indexes: list, deadline: float=None) -> list:
+        # Keep responses of other backends apart from OpenAI responses of the same model
+        model = self.model_name if self.ctx.llm_backend == "openai" else f"{self.ctx.llm_backend}/{self.model_name}"
+        keys = [ResponseCache.make_key(model, self.temperature, self.node_name, i, messages) for i in sample_indexes]
+        if self.ctx.shared_calls is not None:
+            return self.ctx.shared_calls.call(",".join(keys), lambda: self.cache_lookup(keys, messages, sample_indexes, deadline))
+        return self.cache_lookup(keys, messages, sample_indexes, deadline)
+
+
+    # Query the LLM backend through the response cache, one cached response per sample
+    def cache_lookup(self, keys: list, messages: list, sample_indexes: list, deadline: float=None) -> list:
+        cache = get_response_cache()
+        if cache is None:
+            return self.query(messages, len(keys), deadline)
+
+        # Look up cached responses unless recording fresh responses
+        if cache.mode != "record":
+            outputs = [cache.get(key) for key in keys]
+            if all(output is not None for output in outputs):
+                note_cache_hit()
+                return [response_format()(**output) for output in outputs]
+            if cache.mode == "replay":
+                raise CacheMiss(f"No cached response for {self.node_name} {self.name} (samples {sample_indexes})")
+
+        # Query the LLM backend and save responses
+        query_outputs = self.query(messages, len(keys), deadline)
+        for key, query_output in zip(keys, query_outputs):
+            if query_output is not None:
+                cache.put(key, self.model_name, query_output.model_dump())
+        return query_outputs
         
 
+    # Wait for a call slot, then query one sample as a tracked LLM call
+    def tracked_query(self, messages: list, sample_index: int, deadline: float, hedge: bool=False) -> object:
+        scheduler = get_scheduler()
+        slot = scheduler.slot(self.priority, self.ctx.slot_usage) if scheduler is not None else nullcontext()
+        with slot, track_call(question=self.question.get('id'), community=self.node_name, round=self.round_num, agent=self.name,
+                              role="judge" if isinstance(self, CommunityJudge) else "agent",
+                              model=self.model_name, temperature=self.temperature, attempt=sample_index + 1, hedge=hedge):
+            return self.cached_query(messages, sample_index, deadline)
+
+
+    # Format community chat history into query messages
+    def build_messages(self, chat_hist: list, agent_name: str=None) -> list:
+        return [{"role": "system", "content": self.meta_prompt},
+                {"role": "user", "content": self.format_user_prompt(chat_hist, agent_name)}]
+
+
+    # Convert query output to a response, or None if the answer is out of range
+    def to_response(self, query_output) -> dict:
+        if not 1 <= query_output.answer <= 4:
+            return None
+        return {"Name": self.name, "Answer": query_output.answer, "Reason": query_output.reason}
+
+
     # Ask agent a question
     def ask(self, chat_hist: list) -> dict:
+        with span("ask", question=self.question.get('id'), network=self.network_seq, community=self.node_name, round=self.round_num,
+                  agent=self.name, role="judge" if isinstance(self, CommunityJudge) else "agent"):
+            return self.ask_with_retries(chat_hist)
+
+
+    # Ask agent a question, retrying until it answers or runs out of tries, time or retry budget
+    def ask_with_retries(self, chat_hist: list) -> dict:
         # Check if test mode is enabled
-        if test_mode:
+        if self.ctx.test_mode:
             return {"Name": self.name, "Answer": 1, "Reason": "Test reason"}
 
         # Format community chat history
-        self.format_user_prompt(chat_hist)
-        messages = [{"role": "system", "content": self.meta_prompt},
-                    {"role": "user", "content": self.format_user_prompt(chat_hist)}]
+        messages = self.build_messages(chat_hist)
 
-        # Query OpenAI API and return output
+        # Query the LLM backend and return output, abstaining if the model can't answer in time
+        breaker = get_circuit_breaker(self.model_name)
+        retry_budget = get_retry_budget()
+        deadline = time.monotonic() + self.ctx.ask_deadline
         tries = 0
         fail = False
         while True:
+            # Check call limits before each try
+            if tries >= self.ctx.max_ask_tries:
+                return self.abstain(f"no valid answer after {tries} tries")
+            if time.monotonic() >= deadline:
+                return self.abstain(f"deadline of {self.ctx.ask_deadline}s exceeded")
+            if tries > 0 and not retry_budget.acquire():
+                return self.abstain("retry budget exhausted")
+
             try:
                 tries += 1
-                query_output = self.query(messages)
-                output = {"Name": self.name, "Answer": query_output.answer, "Reason": query_output.reason}
+                if not breaker.allow():
+                    raise CircuitOpenError(f"Circuit open for {self.model_name}")
+                # Make the call, and a hedged duplicate in its own call slot if it runs slow
+                sample_index = tries - 1
+                with span("attempt", attempt=tries):
+                    if self.ctx.hedge_requests:
+                        query_output = hedged_call(lambda: self.tracked_query(messages, sample_index, deadline), self.model_name,
+                                                   lambda: self.tracked_query(messages, sample_index, deadline, hedge=True))
+                    else:
+                        query_output = self.tracked_query(messages, sample_index, deadline)
+                breaker.record_success()
+                retry_budget.record_success()
+                output = self.to_response(query_output)
                 print("\nSuccess after fail\n" if fail else "", end='')
-                if 1 <= query_output.answer <= 4:
+                if output is not None:
                     break
+            except (CacheMiss, LLMConfigError):
+                # Replay mode cannot recover from a missing response, and no try can fix a misconfigured backend
+                raise
+            except CircuitOpenError as e:
+                # Endpoint is failing, don't add load to it
+                return self.abstain(str(e))
             except Exception as e:
                 # Retry if there's an error
+                breaker.record_failure()
                 print(f"\nTry number {tries} >> {e}")
                 fail = True
                 continue
             
         return output
+
+
+    # Record an abstain answer when the agent can't be queried
+    def abstain(self, reason: str) -> dict:
+        print(f"\n{self.node_name} {self.name} abstained: {reason}\n")
+        return {"Name": self.name, "Answer": 0, "Reason": f"Abstained, {reason}.", "Abstained": True}
     
 
 # Agent subclass for community judge
 class CommunityJudge(Agent):
-    def __init__(self, question: str, name: str='Judge', temperature: float=comm_judge_temp):
-        super().__init__(name, question, temperature)
+    def __init__(self, question: str, ctx, name: str='Judge', temperature: float=None):
+        super().__init__(name, question, ctx, ctx.comm_judge_temp if temperature is None else temperature, name)
 
         # Judge specific initialization
-        self.model_name = chat_models[judge_model_index]
+        self.model_name = ctx.chat_models[ctx.judge_model_index]
         self.meta_prompt = load_judge_meta_prompt()
-        self.user_prompt = load_judge_user_prompt()
\ No newline at end of file
+        self.user_prompt = load_judge_user_prompt()
+
+# Name agents go by in a prompt they share
+SHARED_AGENT_NAME = "one of the debating agents"
+
+
+# Check if every agent of a wave would send the same prompt apart from its name
+def shares_prompt(requests: list) -> bool:
+    agent, chat_hist = requests[0]
+    return all(type(other) is Agent and other.node_name == agent.node_name and other.model_name == agent.model_name
+               and other.temperature == agent.temperature and other_hist is chat_hist for other, other_hist in requests)
+
+
+# Ask agents sharing a prompt with one request for a sample per agent, asking agents with unusable samples on their own
+def ask_sampled(agents: list, chat_hist: list) -> list:
+    first = agents[0]
+    if first.ctx.test_mode:
+        return [agent.ask(chat_hist) for agent in agents]
+
+    # Render the shared prompt once and request a sample per agent
+    messages = first.build_messages(chat_hist, SHARED_AGENT_NAME)
+    breaker = get_circuit_breaker(first.model_name)
+    scheduler = get_scheduler()
+    outputs = []
+    if breaker.allow():
+        try:
+            sampled = span("sampled_ask", question=first.question.get('id'), network=first.network_seq, community=first.node_name,
+                           round=first.round_num, agents=len(agents))
+            slot = scheduler.slot(first.priority, first.ctx.slot_usage) if scheduler is not None else nullcontext()
+            with sampled, slot, track_call(question=first.question.get('id'), community=first.node_name, round=first.round_num,
+                                  agent=f"{len(agents)} sampled agents", role="agent", model=first.model_name,
+                                  temperature=first.temperature, attempt=1):
+                outputs = first.cached_samples(messages, list(range(len(agents))))
+            breaker.record_success()
+            get_retry_budget().record_success()
+        except (CacheMiss, LLMConfigError):
+            # Replay mode cannot recover from a missing response, and no try can fix a misconfigured backend
+            raise
+        except Exception as e:
+            breaker.record_failure()
+            print(f"\n{first.node_name} sampled request failed >> {e}")
+
+    # Map samples to agents in order, resampling malformed, out of range or missing samples one agent at a time
+    responses = []
+    for i, agent in enumerate(agents):
+        output = outputs[i] if i < len(outputs) else None
+        response = agent.to_response(output) if output is not None else None
+        responses.append(response if response is not None else agent.ask(chat_hist))
+    return responses
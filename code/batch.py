@@ -0,0 +1,204 @@
+import json
+import os
+import time
+from client_pool import get_client
+from llm_backend import get_llm_backend, response_format, format_response_param
+
+# Batch statuses that will not change
+finished_statuses = ["completed", "failed", "expired", "cancelled"]
+
+
+# Build a batch request line for an agent query
+def build_request(custom_id: str, agent, chat_hist: list) -> dict:
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {**agent.request_body(agent.build_messages(chat_hist)), "response_format": format_response_param()}
+    }
+
+
+# Get message content from a batch output line, or None if the request failed
+def read_output(line: dict) -> str:
+    response = line.get('response')
+    if line.get('error') or not response or response.get('status_code') != 200:
+        return None
+    return response['body']['choices'][0]['message']['content']
+
+
+# Write batch request lines to a JSONL file
+def write_jsonl(path: str, lines: list) -> None:
+    with open(path, 'w') as f:
+        for line in lines:
+            f.write(json.dumps(line) + "\n")
+
+
+# Read batch output lines into a custom_id to content dict
+def read_outputs(text: str) -> dict:
+    outputs = {}
+    for raw_line in text.splitlines():
+        if raw_line.strip():
+            line = json.loads(raw_line)
+            outputs[line['custom_id']] = read_output(line)
+    return outputs
+
+
+# Batch backend using the OpenAI Batch API
+class OpenAIBatchBackend:
+    def __init__(self, batch_dir: str, poll_interval: float, verbose: bool=False):
+        self.batch_dir = batch_dir
+        self.poll_interval = poll_interval
+        self.verbose = verbose
+        self.client = get_client()
+
+
+    # Submit a batch and wait for its outputs
+    def run_batch(self, name: str, lines: list) -> dict:
+        path = os.path.join(self.batch_dir, f"{name}.jsonl")
+        write_jsonl(path, lines)
+        with open(path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+
+        # Poll until the batch is finished
+        while batch.status not in finished_statuses:
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+        print(f"\nBatch {name} {batch.status}\n" if self.verbose else "", end='')
+
+        # Download outputs, failed requests are missing from the output file
+        if batch.output_file_id is None:
+            return {}
+        return read_outputs(self.client.files.content(batch.output_file_id).text)
+
+
+# Batch backend exchanging JSONL files in a local directory
+class LocalBatchBackend:
+    def __init__(self, batch_dir: str, poll_interval: float, responder=None):
+        self.input_dir = os.path.join(batch_dir, "input")
+        self.output_dir = os.path.join(batch_dir, "output")
+        self.poll_interval = poll_interval
+        self.responder = responder
+        os.makedirs(self.input_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+
+    # Write a batch and wait for its output file
+    def run_batch(self, name: str, lines: list) -> dict:
+        write_jsonl(os.path.join(self.input_dir, f"{name}.jsonl"), lines)
+        output_path = os.path.join(self.output_dir, f"{name}.jsonl")
+
+        # Answer the batch in process if there's a responder, otherwise wait for another process
+        if self.responder is not None:
+            write_jsonl(output_path, [self.respond(line) for line in lines])
+        while not os.path.exists(output_path):
+            time.sleep(self.poll_interval)
+        with open(output_path, 'r') as f:
+            return read_outputs(f.read())
+
+
+    # Answer a request line in the Batch API output format
+    def respond(self, line: dict) -> dict:
+        content = json.dumps(self.responder(line['body']))
+        body = {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+        return {"custom_id": line['custom_id'], "response": {"status_code": 200, "body": body}, "error": None}
+
+
+# Batch backend answering each batch with one generate_many call of the run's LLM backend
+class LLMBatchBackend:
+    def __init__(self, backend, timeout: float):
+        self.backend = backend
+        self.timeout = timeout
+
+
+    # Send every request of the batch at once, failed requests are missing from the outputs
+    def run_batch(self, name: str, lines: list) -> dict:
+        outputs = self.backend.generate_many([line['body'] for line in lines], self.timeout)
+        return {line['custom_id']: output.model_dump_json() for line, output in zip(lines, outputs) if output is not None}
+
+
+# Answer every request with the same test response
+def test_responder(body: dict) -> dict:
+    return {"answer": 1, "reason": "Test reason"}
+
+
+# Get the batch backend of a run
+def get_batch_backend(ctx):
+    os.makedirs(ctx.batch_dir, exist_ok=True)
+    if ctx.batch_backend == "openai":
+        return OpenAIBatchBackend(ctx.batch_dir, ctx.batch_poll_interval, ctx.verbose)
+    if ctx.batch_backend == "local":
+        return LocalBatchBackend(ctx.batch_dir, ctx.batch_poll_interval, test_responder)
+    if ctx.batch_backend == "local-external":
+        return LocalBatchBackend(ctx.batch_dir, ctx.batch_poll_interval)
+    if ctx.batch_backend == "llm":
+        return LLMBatchBackend(get_llm_backend(ctx), ctx.call_deadline)
+    raise ValueError(f"Unknown batch backend '{ctx.batch_backend}'")
+
+
+# Advances every network one query wave at a time through a batch backend
+class BatchRunner:
+    def __init__(self, backend, ctx):
+        self.backend = backend
+        self.ctx = ctx
+        self.run_id = time.strftime("%Y%m%d-%H%M%S")
+        self.num_batches = 0
+
+
+    # Run networks together and yield (index, all_responses) as each finishes
+    def run(self, networks: list):
+        # Start every network
+        active = {}
+        for i, network in enumerate(networks):
+            network_waves = network.waves()
+            active[i] = [network_waves, next(network_waves)]
+
+        while active:
+            # Answer all pending requests across networks in one batch
+            requests = [request for _, network_requests in active.values() for request in network_requests]
+            responses = self.answer_wave(requests)
+
+            # Hand each network its responses and yield finished networks
+            pos = 0
+            for i in list(active):
+                network_waves, network_requests = active[i]
+                network_responses = responses[pos:pos + len(network_requests)]
+                pos += len(network_requests)
+                try:
+                    active[i][1] = network_waves.send(network_responses)
+                except StopIteration as stop:
+                    del active[i]
+                    yield i, stop.value
+
+
+    # Answer a wave of (agent, chat_hist) requests, resubmitting failed or out of range answers
+    def answer_wave(self, requests: list) -> list:
+        responses = [None] * len(requests)
+        from pydantic import ValidationError
+        for attempt in range(self.ctx.batch_max_attempts):
+            pending = [i for i, response in enumerate(responses) if response is None]
+            if not pending:
+                break
+
+            # Submit pending requests as one batch
+            name = f"{self.run_id}-batch{self.num_batches}"
+            self.num_batches += 1
+            lines = [build_request(f"request-{i}", *requests[i]) for i in pending]
+            print(f"\nSubmitting {name} with {len(lines)} requests (attempt {attempt+1})\n" if self.ctx.verbose else "", end='')
+            outputs = self.backend.run_batch(name, lines)
+
+            # Parse outputs into agent responses
+            for i in pending:
+                content = outputs.get(f"request-{i}")
+                if content is None:
+                    continue
+                try:
+                    responses[i] = requests[i][0].to_response(response_format().model_validate_json(content))
+                except ValidationError:
+                    continue
+
+        # Fail if any request never got a usable answer
+        missing = sum(response is None for response in responses)
+        if missing:
+            raise RuntimeError(f"{missing} batch requests failed after {self.ctx.batch_max_attempts} attempts.")
+        return responses
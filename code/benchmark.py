@@ -0,0 +1,199 @@
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from mock_server import MockOpenAIServer, ANSWER_POLICIES
+from config_loader import CODE_DIR, read_config
+
+
+# Percentile of a list of values
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+# Synthetic multiple choice question
+def synthetic_question(i: int) -> dict:
+    return {'id': i, 'question': f"Synthetic benchmark question {i}: which option is correct?",
+            'choices': [f"Option {c} for question {i}" for c in "ABCD"]}
+
+
+# Run questions through the network in this process and print timings as JSON
+def run_worker(num_questions: int, concurrency: int) -> None:
+    from network import Network
+    from run_context import RunContext
+    from scheduler import get_scheduler
+    ctx = RunContext.from_file()
+
+    # Time one question
+    def run_question(i: int) -> float:
+        start = time.perf_counter()
+        Network(synthetic_question(i), ctx.topology, ctx).run_network()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        latencies = list(executor.map(run_question, range(num_questions)))
+    scheduler = get_scheduler()
+    print(json.dumps({'wall_time': time.perf_counter() - start, 'latencies': latencies,
+                      'scheduler': scheduler.stats() if scheduler is not None else None}))
+
+
+# Run one benchmark case in a fresh worker process against the mock server
+def run_case(server: MockOpenAIServer, base_config: dict, preset: int, num_questions: int, concurrency: int, output_dir: str) -> dict:
+    # Worker config
+    config = dict(base_config)
+    config.update({
+        'verbose': False, 'verbose_responses': False, 'verbose_message_passing': False,
+        'test_mode': False, 'metrics': False, 'cache_mode': "off", 'journal_path': "",
+        'output_path': output_dir, 'network_preset': preset,
+        'max_concurrent_questions': concurrency, 'execution_mode': "interactive",
+        'rate_limits': {'default': {'rpm': 1000000, 'tpm': 1000000000}}
+    })
+    config_path = os.path.join(output_dir, f"config_{preset}_{num_questions}_{concurrency}.json")
+    with open(config_path, 'w') as f:
+        json.dump(config, f)
+
+    # Run worker and count requests it sent to the mock server
+    env = dict(os.environ, MAD_CONFIG=config_path, OPENAI_BASE_URL=server.base_url, OPENAI_API_KEY="mock")
+    requests_before = server.requests
+    result = subprocess.run([sys.executable, __file__, "--worker", "--questions", str(num_questions), "--concurrency", str(concurrency)],
+                            env=env, capture_output=True, text=True, cwd=CODE_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmark worker failed:\n{result.stderr}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    requests = server.requests - requests_before
+
+    return {
+        'preset': preset,
+        'questions': num_questions,
+        'concurrency': concurrency,
+        'questions_per_second': round(num_questions / timings['wall_time'], 3),
+        'p50_latency': round(percentile(timings['latencies'], 50), 3),
+        'p99_latency': round(percentile(timings['latencies'], 99), 3),
+        'calls_per_question': round(requests / num_questions, 2),
+        'slot_utilization': timings['scheduler']['utilization'] if timings['scheduler'] else None
+    }
+
+
+# Time cold starts of the CLI checking its config, network and dataset, run from outside the code directory
+def measure_startup(runs: int, output_dir: str) -> dict:
+    # Small GPQA style dataset so the check doesn't depend on downloaded data
+    dataset_path = os.path.join(output_dir, "startup_questions.csv")
+    with open(dataset_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Question", "Correct Answer", "Incorrect Answer 1", "Incorrect Answer 2", "Incorrect Answer 3", "Canary String"])
+        for i in range(100):
+            question = synthetic_question(i)
+            writer.writerow([question['question'], *question['choices'], ""])
+
+    # Time each run, the first one also builds the dataset index
+    command = [sys.executable, os.path.join(CODE_DIR, "MAD-Community.py"), "--dry-run",
+               "--set", "dataset=\"gpqa\"", "--set", f"dataset_path={json.dumps(dataset_path)}"]
+    times = []
+    for _ in range(runs + 1):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=output_dir, capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"Startup check failed:\n{result.stderr}")
+    return {'runs': runs, 'p50_startup': round(percentile(times[1:], 50), 3), 'p90_startup': round(percentile(times[1:], 90), 3)}
+
+
+# Compare results to a baseline and return the regressions beyond the tolerance
+def find_regressions(results: list, baseline: list, tolerance: float) -> list:
+    baseline_by_case = {(b['preset'], b['questions'], b['concurrency']): b for b in baseline}
+    regressions = []
+    for result in results:
+        base = baseline_by_case.get((result['preset'], result['questions'], result['concurrency']))
+        if base is None:
+            continue
+        if result['questions_per_second'] < base['questions_per_second'] * (1 - tolerance):
+            regressions.append(f"preset {result['preset']}, {result['questions']} questions, concurrency {result['concurrency']}: "
+                               f"{result['questions_per_second']} q/s vs baseline {base['questions_per_second']} q/s")
+        if result['p99_latency'] > base['p99_latency'] * (1 + tolerance):
+            regressions.append(f"preset {result['preset']}, {result['questions']} questions, concurrency {result['concurrency']}: "
+                               f"p99 {result['p99_latency']}s vs baseline {base['p99_latency']}s")
+    return regressions
+
+
+# Run the benchmark grid from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark against a local mock OpenAI server")
+    parser.add_argument("--presets", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--questions", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--latency", default="lognormal:-2.3,0.5", help="mock latency: fixed:S, uniform:LO,HI or lognormal:MU,SIGMA")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--server-error-rate", type=float, default=0.0)
+    parser.add_argument("--answer-policy", choices=ANSWER_POLICIES, default="random")
+    parser.add_argument("--output", help="save results to a JSON file")
+    parser.add_argument("--baseline", help="fail if results regress from this JSON file of earlier results")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional regression from the baseline")
+    parser.add_argument("--startup", action="store_true", help="benchmark CLI startup time instead of throughput")
+    parser.add_argument("--startup-runs", type=int, default=10)
+    parser.add_argument("--max-startup", type=float, help="fail if the p50 startup time is above this many seconds")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Worker process runs a single case
+    if args.worker:
+        run_worker(args.questions[0], args.concurrency[0])
+        sys.exit()
+
+    # Startup benchmark
+    if args.startup:
+        with tempfile.TemporaryDirectory() as output_dir:
+            startup = measure_startup(args.startup_runs, output_dir)
+        print(f"Startup over {startup['runs']} runs: p50 {startup['p50_startup']}s, p90 {startup['p90_startup']}s")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(startup, f, indent=4)
+
+        # Check against the threshold and baseline
+        limits = [args.max_startup] if args.max_startup is not None else []
+        if args.baseline:
+            with open(args.baseline, 'r') as f:
+                limits.append(json.load(f)['p50_startup'] * (1 + args.tolerance))
+        if limits and startup['p50_startup'] > min(limits):
+            print(f"\nRegression: p50 startup {startup['p50_startup']}s is above {round(min(limits), 3)}s")
+            sys.exit(1)
+        sys.exit()
+
+    base_config = read_config()
+    server = MockOpenAIServer(latency=args.latency, rate_limit_rate=args.rate_limit_rate,
+                              server_error_rate=args.server_error_rate, answer_policy=args.answer_policy).start()
+
+    # Run every case
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        print(f"{'preset':>6} {'questions':>9} {'conc':>5} {'q/s':>8} {'p50 s':>8} {'p99 s':>8} {'calls/q':>8}")
+        for preset in args.presets:
+            for num_questions in args.questions:
+                for concurrency in args.concurrency:
+                    result = run_case(server, base_config, preset, num_questions, concurrency, output_dir + os.sep)
+                    results.append(result)
+                    print(f"{preset:>6} {num_questions:>9} {concurrency:>5} {result['questions_per_second']:>8} "
+                          f"{result['p50_latency']:>8} {result['p99_latency']:>8} {result['calls_per_question']:>8}")
+    server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    # Check for regressions against the baseline
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
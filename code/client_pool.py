@@ -0,0 +1,23 @@
+import threading
+from config_loader import load_config
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+# Get the shared OpenAI client for a base URL, creating it on first use
+def get_client(base_url: str=None, api_key: str=None) -> object:
+    with _clients_lock:
+        if base_url not in _clients:
+            # Import the client on first use, it is the slowest import of a run
+            import httpx
+            from openai import OpenAI, DefaultHttpxClient
+
+            # Keep connections alive so they are reused across agents and questions
+            config = load_config()
+            limits = httpx.Limits(max_connections=config['max_connections'],
+                                  max_keepalive_connections=config['max_connections'],
+                                  keepalive_expiry=config['keepalive_expiry'])
+            # Retries are handled by Agent.query under the shared retry budget
+            _clients[base_url] = OpenAI(base_url=base_url, api_key=api_key, max_retries=0, http_client=DefaultHttpxClient(limits=limits))
+        return _clients[base_url]
@@ -1,35 +1,101 @@
 import json
+import os
+import string
 import sys
+from functools import lru_cache
+
+# Config files live next to the code, so runs work from any directory
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_DIR = os.path.join(CODE_DIR, 'config')
+
+# Config keys holding paths, resolved against the code directory
+PATH_KEYS = ['output_path', 'journal_path', 'dataset_path', 'cache_path', 'batch_dir', 'shard_dir']
+
+# Config keys of process-wide helpers such as the client pool, rate limiters and call scheduler, shared by every run of a process
+PROCESS_KEYS = ['max_connections', 'keepalive_expiry', 'rate_limits', 'rate_limit_headroom', 'retry_budget_ratio', 'retry_budget_min',
+                'circuit_failure_threshold', 'circuit_reset_time', 'hedge_min_samples', 'hedge_percentile', 'cache_mode', 'cache_path',
+                'cache_max_entries', 'cache_max_age_days', 'llm_call_slots', 'scheduler_priority', 'metrics', 'trace']
 
 _config = None
 
-# Load global config file
-def load_config() -> json:
+
+# Read a config file, apply KEY=VALUE overrides and resolve relative paths
+def read_config(path: str=None, overrides: list=[]) -> dict:
+    with open(path or os.environ.get('MAD_CONFIG', os.path.join(CONFIG_DIR, '_config.json')), 'r') as f:
+        config = json.load(f)
+
+    # Apply overrides, parsing values as JSON and falling back to plain strings
+    for override in overrides:
+        key, sep, value = override.partition("=")
+        if not sep:
+            raise ValueError(f"Config override '{override}' should look like KEY=VALUE")
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            pass
+        keys = key.split(".")
+        if keys[0] not in config:
+            raise ValueError(f"Unknown config key '{keys[0]}'")
+        target = config
+        for part in keys[:-1]:
+            target = target.setdefault(part, {})
+        target[keys[-1]] = value
+
+    # Resolve relative paths, keeping empty paths that disable a feature
+    for key in PATH_KEYS:
+        if config.get(key) and not os.path.isabs(config[key]):
+            config[key] = os.path.join(CODE_DIR, config[key])
+    return config
+
+
+# Get the active config, reading the default config file on first use
+def load_config() -> dict:
     global _config
     if _config is None:
-        with open('./config/_config.json', 'r') as f:
-            _config = json.load(f)
+        _config = read_config()
     return _config
 
+
+# Make a config the active one for helpers that aren't handed a run context
+def set_config(config: dict) -> None:
+    global _config
+    _config = config
+
+# Prompt template parsed once into literal text and placeholder fields
+class PromptTemplate:
+    def __init__(self, template: str):
+        self.template = template
+        self.parts = [(literal, field) for literal, field, _, _ in string.Formatter().parse(template)]
+
+
+    # Fill placeholders in the template
+    def format(self, **kwargs) -> str:
+        return "".join(literal + (str(kwargs[field]) if field is not None else "") for literal, field in self.parts)
+
+
 # Load agent meta prompt
+@lru_cache(maxsize=None)
 def load_agent_meta_prompt() -> str:
-    with open('./config/agent_meta_prompt.txt', 'r') as f:
+    with open(os.path.join(CONFIG_DIR, 'agent_meta_prompt.txt'), 'r') as f:
         return f.read()
 
 # Load agent user prompt
-def load_agent_user_prompt() -> str:
-    with open('./config/agent_user_prompt.txt', 'r') as f:
-        return f.read()
+@lru_cache(maxsize=None)
+def load_agent_user_prompt() -> PromptTemplate:
+    with open(os.path.join(CONFIG_DIR, 'agent_user_prompt.txt'), 'r') as f:
+        return PromptTemplate(f.read())
 
 # Load judge meta prompt
+@lru_cache(maxsize=None)
 def load_judge_meta_prompt() -> str:
-    with open('./config/judge_meta_prompt.txt', 'r') as f:
+    with open(os.path.join(CONFIG_DIR, 'judge_meta_prompt.txt'), 'r') as f:
         return f.read()
     
 # Load judge user prompt
-def load_judge_user_prompt() -> str:
-    with open('./config/judge_user_prompt.txt', 'r') as f:
-        return f.read()
+@lru_cache(maxsize=None)
+def load_judge_user_prompt() -> PromptTemplate:
+    with open(os.path.join(CONFIG_DIR, 'judge_user_prompt.txt'), 'r') as f:
+        return PromptTemplate(f.read())
     
 
 # Load network configuration/preset
@@ -37,7 +103,7 @@ def load_network_config(preset_config: int=0) -> list:
     lines = []
     if preset_config == 0:
         # Open network config file
-        with open('./config/network_config.txt', 'r') as file:
+        with open(os.path.join(CONFIG_DIR, 'network_config.txt'), 'r') as file:
             lines = file.read().splitlines()
     else:
         lines = set_network_config(preset_config)
@@ -90,7 +156,7 @@ def clear_network_config(num_communities: int) -> None:
     
     # Write to file
     output = "\n".join(result)
-    with open("./config/network_config.txt", 'w') as file:
+    with open(os.path.join(CONFIG_DIR, "network_config.txt"), 'w') as file:
         file.write(output)
 
     print(f"Network matrix of {num_communities} communities initialized.")
@@ -99,6 +165,12 @@ def clear_network_config(num_communities: int) -> None:
     sys.exit()
 
 
+# Numbers of the presets in network_config_presets.txt
+def load_preset_numbers() -> list:
+    with open(os.path.join(CONFIG_DIR, "network_config_presets.txt"), 'r') as file:
+        return [int(line[1:line.index("]")]) for line in file.read().splitlines() if line.startswith("[")]
+
+
 # Set network configuration from preset
 def set_network_config(preset_index: int) -> list:
     # Read from network_config.txt if no preset is chosen
@@ -107,7 +179,7 @@ def set_network_config(preset_index: int) -> list:
         return
 
     # Read from network_config_presets.txt
-    with open("./config/network_config_presets.txt", 'r') as file:
+    with open(os.path.join(CONFIG_DIR, "network_config_presets.txt"), 'r') as file:
         lines = file.read().splitlines()
 
     # Get preset lines
@@ -0,0 +1,155 @@
+import csv
+import os
+import pickle
+import random
+import re
+from array import array
+
+# Bump when the index or cache layout changes
+index_version = 1
+
+
+# GPQA CSV with named answer columns
+class GPQAAdapter:
+    name = "gpqa"
+    has_header = True
+
+
+    # Normalize a row into a question record
+    def parse(self, fields: list, columns: list) -> dict:
+        row = dict(zip(columns, fields))
+        return {'tag': row['Canary String'], 'question': row['Question'], 'correct': row['Correct Answer'],
+                'incorrect': [row['Incorrect Answer 1'], row['Incorrect Answer 2'], row['Incorrect Answer 3']]}
+
+
+# MMLU CSV without a header: question, A, B, C, D, answer letter
+class MMLUAdapter:
+    name = "mmlu"
+    has_header = False
+
+
+    # Normalize a row into a question record
+    def parse(self, fields: list, columns: list) -> dict:
+        question, options, answer = fields[0], fields[1:5], fields[5].strip()
+        correct_idx = "ABCD".index(answer)
+        return {'tag': "", 'question': question, 'correct': options[correct_idx],
+                'incorrect': [option for i, option in enumerate(options) if i != correct_idx]}
+
+
+# ARC CSV with the options inlined in the question as "(A) ... (B) ..."
+class ARCAdapter:
+    name = "arc"
+    has_header = True
+    option_pattern = re.compile(r"\s*\(([A-E1-5])\)\s*")
+
+
+    # Normalize a row into a question record, skipping questions without exactly four options
+    def parse(self, fields: list, columns: list) -> dict:
+        row = dict(zip(columns, fields))
+        parts = self.option_pattern.split(row['question'])
+        labels, options = parts[1::2], [option.strip() for option in parts[2::2]]
+        answer = row['AnswerKey'].strip()
+        if len(options) != 4 or answer not in labels:
+            return None
+        correct_idx = labels.index(answer)
+        return {'tag': row['questionID'], 'question': parts[0].strip(), 'correct': options[correct_idx],
+                'incorrect': [option for i, option in enumerate(options) if i != correct_idx]}
+
+
+DATASET_ADAPTERS = {adapter.name: adapter for adapter in [GPQAAdapter, MMLUAdapter, ARCAdapter]}
+
+
+# Multiple choice dataset read row by row from a pre-parsed binary cache of a CSV
+class Dataset:
+    def __init__(self, path: str, adapter):
+        self.path = path
+        self.adapter = adapter
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.cache_path = f"{path}.{adapter.name}.bin"
+        self.index_path = f"{path}.{adapter.name}.idx"
+        self.offsets = self.load_index()
+
+
+    # Number of usable questions
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+    # Load the index, rebuilding it and the cache if the CSV changed
+    def load_index(self) -> array:
+        stat = os.stat(self.path)
+        source = (index_version, stat.st_size, stat.st_mtime_ns)
+        if os.path.exists(self.index_path) and os.path.exists(self.cache_path):
+            with open(self.index_path, 'rb') as f:
+                index = pickle.load(f)
+            if index['source'] == source:
+                return index['offsets']
+        return self.build_index(source)
+
+
+    # Split the CSV into raw records, keeping quoted newlines inside a record
+    def read_records(self):
+        with open(self.path, 'rb') as f:
+            record = b""
+            for line in f:
+                record += line
+                # A record ends once its quotes are balanced
+                if record.count(b'"') % 2 == 0:
+                    yield record
+                    record = b""
+            if record.strip():
+                yield record
+
+
+    # Parse the CSV once, writing each record to the cache and its offset to the index
+    def build_index(self, source: tuple) -> array:
+        offsets = array('Q', [0])
+        columns = None
+        with open(f"{self.cache_path}.tmp", 'wb') as cache:
+            for raw in self.read_records():
+                text = raw.decode('utf-8-sig' if columns is None else 'utf-8')
+                fields = next(csv.reader([text]), [])
+                if not fields:
+                    continue
+                if columns is None and self.adapter.has_header:
+                    columns = fields
+                    continue
+                columns = columns or []
+                record = self.adapter.parse(fields, columns)
+                if record is None:
+                    continue
+                record['id'] = len(offsets) - 1
+                cache.write(pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL))
+                offsets.append(cache.tell())
+        with open(f"{self.index_path}.tmp", 'wb') as f:
+            pickle.dump({'source': source, 'offsets': offsets}, f)
+
+        # Swap in the new files so concurrent runs never read half-written ones
+        os.replace(f"{self.cache_path}.tmp", self.cache_path)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+        return offsets
+
+
+    # Question ids from start for count questions
+    def select(self, start: int, count: int) -> list:
+        return list(range(min(start, len(self)), min(start + count, len(self))))
+
+
+    # Seeded sample of question ids without reading any rows
+    def sample(self, count: int, seed: int) -> list:
+        return random.Random(seed).sample(range(len(self)), min(count, len(self)))
+
+
+    # Stream question records for the given ids
+    def rows(self, ids: list):
+        with open(self.cache_path, 'rb') as f:
+            for i in ids:
+                f.seek(self.offsets[i])
+                yield pickle.loads(f.read(self.offsets[i + 1] - self.offsets[i]))
+
+
+# Open a dataset CSV with the adapter of its format
+def load_dataset(name: str, path: str) -> Dataset:
+    if name not in DATASET_ADAPTERS:
+        raise ValueError(f"Unknown dataset '{name}', expected one of {list(DATASET_ADAPTERS)}")
+    return Dataset(path, DATASET_ADAPTERS[name]())
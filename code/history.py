@@ -0,0 +1,83 @@
+import threading
+
+# History strategies
+HISTORY_STRATEGIES = ["full", "last_round", "last_n", "token_budget"]
+
+
+# Tokens saved by history windowing over a run
+class HistorySavings:
+    def __init__(self):
+        self.prompts = 0
+        self.full_tokens = 0
+        self.sent_tokens = 0
+        self.lock = threading.Lock()
+
+
+    # Record the full and windowed size of one rendered history
+    def record(self, full_tokens: int, sent_tokens: int) -> None:
+        with self.lock:
+            self.prompts += 1
+            self.full_tokens += full_tokens
+            self.sent_tokens += sent_tokens
+
+
+    # Tokens not sent because of windowing
+    def saved(self) -> int:
+        return self.full_tokens - self.sent_tokens
+
+
+# Estimate tokens of text with about 4 characters per token
+def count_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+# Format a response as a line of the chat history
+def format_response(response: dict, reason: str=None) -> str:
+    reason = response['Reason'] if reason is None else reason
+    return f'{response["Name"]}: Chose {response["Answer"]} because "{reason}"'
+
+
+# Keep the newest responses that fit the token budget, shortening the reason of the first that doesn't
+def fit_token_budget(chat_hist: list, budget: int) -> list:
+    lines = []
+    remaining = budget
+    for response in reversed(chat_hist):
+        line = format_response(response)
+        tokens = count_tokens(line) + 1
+        if tokens <= remaining:
+            lines.append(line)
+            remaining -= tokens
+            continue
+
+        # Compress the reason to the words that still fit, then drop everything older
+        words = response['Reason'].split()
+        while words and count_tokens(format_response(response, " ".join(words) + "...")) + 1 > remaining:
+            words.pop()
+        if words:
+            lines.append(format_response(response, " ".join(words) + "..."))
+        break
+    return lines[::-1]
+
+
+# Render the chat history shown to an agent with a history strategy
+def render_history(chat_hist: list, ctx, strategy: str=None) -> str:
+    strategy = ctx.history_strategy if strategy is None else strategy
+    if strategy not in HISTORY_STRATEGIES:
+        raise ValueError(f"Unknown history strategy '{strategy}', expected one of {HISTORY_STRATEGIES}")
+    full_lines = [format_response(response) for response in chat_hist]
+
+    # Window the history
+    if strategy == "last_round":
+        lines = full_lines[-ctx.num_agents:]
+    elif strategy == "last_n":
+        lines = full_lines[-ctx.history_last_n:] if ctx.history_last_n > 0 else []
+    elif strategy == "token_budget":
+        lines = fit_token_budget(chat_hist, ctx.history_token_budget)
+    else:
+        lines = full_lines
+
+    # Record tokens saved
+    history = "\n".join(lines)
+    if strategy != "full":
+        ctx.history_savings.record(count_tokens("\n".join(full_lines)), count_tokens(history))
+    return history
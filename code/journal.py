@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+
+# Config keys journaled progress depends on, which a resumed run has to share with the journal
+RESUME_KEYS = ['test_mode', 'dataset', 'dataset_path', 'seed', 'num_agents', 'num_rounds', 'chat_models', 'agent_model_index', 'judge_model_index']
+
+
+# Append-only JSONL journal of completed run work, fsync'd after every record
+class RunJournal:
+    def __init__(self, path: str, resume: bool=False, config: dict=None):
+        self.path = path
+        self.lock = threading.Lock()
+
+        # Keep the previous journal instead of overwriting it when starting fresh
+        if not resume and os.path.exists(path):
+            os.replace(path, f"{path}.prev")
+        self.file = open(path, 'a')
+
+        # End a partially written last line left by a crash so new records start on their own line
+        if self.file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.append_line("\n")
+
+        # Start a new journal with the config of the run it belongs to
+        if self.file.tell() == 0 and config is not None:
+            self.append({"type": "config", "config": config})
+
+
+    # Write a record and force it to disk
+    def append(self, record: dict) -> None:
+        self.append_line(json.dumps(record) + "\n")
+
+
+    # Write a line and force it to disk
+    def append_line(self, line: str) -> None:
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+
+    # Record a question's shuffled choice order
+    def record_question(self, row_id: int, question_id: str, choices: list, correct_idx: int) -> None:
+        self.append({"type": "question", "row": row_id, "question_id": question_id, "choices": choices, "correct_idx": correct_idx})
+
+
+    # Record a community's completed chat history
+    def record_node(self, row_id: int, node_index: int, chat_hist: list) -> None:
+        self.append({"type": "node", "row": row_id, "node": node_index, "chat_hist": chat_hist})
+
+
+    # Record the network judge's verdict
+    def record_judge(self, row_id: int, response: dict) -> None:
+        self.append({"type": "judge", "row": row_id, "response": response})
+
+
+    # Close the journal file
+    def close(self) -> None:
+        self.file.close()
+
+
+# Config and topology of a run that its journal records and a resume checks
+def run_fingerprint(ctx) -> dict:
+    topology = ctx.topology
+    fingerprint = {key: ctx.config[key] for key in RESUME_KEYS}
+    fingerprint.update(starting=topology.starting, matrix=topology.matrix, temperatures=topology.temperatures)
+
+    # Match the JSON form read back from the journal
+    return json.loads(json.dumps(fingerprint))
+
+
+# Load the config a journal was started with, or None for a missing journal or one without a config record
+def load_journal_config(path: str) -> dict:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        try:
+            record = json.loads(f.readline())
+        except json.JSONDecodeError:
+            return None
+    return record['config'] if record['type'] == "config" else None
+
+
+# Load a journal into a dict of row id to question progress
+def load_journal(path: str) -> dict:
+    progress = {}
+    if not os.path.exists(path):
+        return progress
+
+    with open(path, 'r') as f:
+        for line in f:
+            # Skip a partially written last line left by a crash
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            if record['type'] == "question":
+                progress[record['row']] = {'choices': record['choices'], 'correct_idx': record['correct_idx'], 'nodes': {}, 'judge': None}
+            elif record['type'] == "node":
+                progress[record['row']]['nodes'][record['node']] = record['chat_hist']
+            elif record['type'] == "judge":
+                progress[record['row']]['judge'] = record['response']
+    return progress
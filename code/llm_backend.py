@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from client_pool import get_client
+from config_loader import load_config
+from metrics import note_usage
+from rate_limiter import get_rate_limiter, estimate_tokens
+
+# LLM backends agents can be queried through
+LLM_BACKENDS = ["openai", "local", "mock"]
+
+
+# Raised when the LLM backend can't be used as configured, such as a missing or rejected key or an invalid request, which retrying won't fix
+class LLMConfigError(Exception):
+    pass
+
+
+# Agent response format, built on first use so pydantic is only imported when querying
+@lru_cache(maxsize=None)
+def response_format() -> type:
+    from pydantic import BaseModel
+
+    class Format(BaseModel):
+        answer: int
+        reason: str
+    return Format
+
+
+# Structured output response format for the Format schema
+def format_response_param() -> dict:
+    schema = response_format().model_json_schema()
+    schema['additionalProperties'] = False
+    return {"type": "json_schema", "json_schema": {"name": "Format", "schema": schema, "strict": True}}
+
+
+# Message of an OpenAI error, taken from its response body if it has one
+def error_message(ai_err) -> str:
+    body = getattr(ai_err, 'body', None)
+    return body.get("message", str(ai_err)) if isinstance(body, dict) else str(ai_err)
+
+
+# Check if an OpenAI error is an auth, permission or request error that retrying won't fix
+def is_config_error(ai_err) -> bool:
+    from openai import AuthenticationError, PermissionDeniedError, BadRequestError, NotFoundError
+    return isinstance(ai_err, (AuthenticationError, PermissionDeniedError, BadRequestError, NotFoundError))
+
+
+# OpenAI API backend, sending requests under each model's rate limit
+class OpenAIBackend:
+    # Send one {model, messages, temperature} request and return its Format output
+    def generate(self, request: dict, timeout: float) -> object:
+        output = self.generate_samples(request, 1, timeout)[0]
+        if output is None:
+            raise ValueError(f"No valid output from {request['model']}")
+        return output
+
+
+    # Send one request for n samples of the same prompt and return their Format outputs, None for unusable samples
+    def generate_samples(self, request: dict, n: int, timeout: float) -> list:
+        from openai import OpenAIError, APIStatusError
+
+        # A client that can't be created, such as without an API key, fails every request
+        try:
+            client = get_client()
+        except OpenAIError as ai_err:
+            raise LLMConfigError(f"OpenAI client error: {ai_err}") from ai_err
+
+        # Wait for room under the model's rate limit
+        limiter = get_rate_limiter(request['model'])
+        estimated_tokens = estimate_tokens(request['messages'])
+        limiter.acquire(estimated_tokens)
+        try:
+            raw_response = client.beta.chat.completions.with_raw_response.parse(
+                model=request['model'],
+                messages=request['messages'],
+                temperature=request['temperature'],
+                response_format=response_format(),
+                n=n,
+                timeout=timeout
+            )
+            limiter.update_from_headers(raw_response.headers)
+            response = raw_response.parse()
+            limiter.record_usage(estimated_tokens, response.usage.total_tokens)
+            note_usage(response.usage)
+
+            # Extract outputs from response and return them
+            return [choice.message.parsed for choice in response.choices]
+
+        # Raise LLMConfigError for errors retrying won't fix, OpenAIError for the rest
+        except OpenAIError as ai_err:
+            if isinstance(ai_err, APIStatusError):
+                limiter.update_from_headers(ai_err.response.headers)
+            ai_response_msg = error_message(ai_err)
+            if is_config_error(ai_err):
+                raise LLMConfigError(f"OpenAI Error: {ai_response_msg}") from ai_err
+            raise OpenAIError(f"OpenAI Error: {ai_response_msg}") from ai_err
+
+
+    # Send every request of a wave at once and return their outputs, None for requests that failed
+    def generate_many(self, requests: list, timeout: float) -> list:
+        if not requests:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(requests), load_config()['max_connections'])) as executor:
+            return list(executor.map(lambda request: self.generate_or_none(request, timeout), requests))
+
+
+    # Send one request of a wave, printing its error instead of failing the wave unless the backend can't be used at all
+    def generate_or_none(self, request: dict, timeout: float) -> object:
+        try:
+            return self.generate(request, timeout)
+        except LLMConfigError:
+            raise
+        except Exception as e:
+            print(f"\nRequest to {request['model']} failed >> {e}")
+            return None
+
+
+# OpenAI-compatible local server such as llama.cpp or vLLM, with no external rate limit
+class LocalBackend(OpenAIBackend):
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+
+
+    # Send one request for n samples constrained to the Format JSON schema and parse their outputs
+    def generate_samples(self, request: dict, n: int, timeout: float) -> list:
+        from openai import OpenAIError
+        from pydantic import ValidationError
+        try:
+            # Local servers usually don't check the key, but the client needs one
+            client = get_client(self.base_url, os.environ.get("OPENAI_API_KEY", "local"))
+            response = client.chat.completions.create(
+                model=request['model'],
+                messages=request['messages'],
+                temperature=request['temperature'],
+                response_format=format_response_param(),
+                n=n,
+                timeout=timeout
+            )
+        except OpenAIError as ai_err:
+            if is_config_error(ai_err):
+                raise LLMConfigError(f"Local server error at {self.base_url}: {error_message(ai_err)}") from ai_err
+            raise OpenAIError(f"Local server error at {self.base_url}: {ai_err}") from ai_err
+        note_usage(response.usage)
+
+        # Leave malformed samples out so they can be resampled
+        outputs = []
+        for choice in response.choices:
+            try:
+                outputs.append(response_format().model_validate_json(choice.message.content))
+            except ValidationError:
+                outputs.append(None)
+        return outputs
+
+
+# Deterministic backend answering from a hash of each request, for runs without any server
+class MockBackend(OpenAIBackend):
+    # Answer each sample of a request the same way every time it is sent, independently per community
+    def generate_samples(self, request: dict, n: int, timeout: float) -> list:
+        body = json.dumps([request['model'], request['messages'], request['temperature'], request.get('node', "")], sort_keys=True)
+        outputs = []
+        for i in range(n):
+            answer = hashlib.sha256(f"{body}{i}".encode()).digest()[0] % 4 + 1
+            outputs.append(response_format()(answer=answer, reason=f"Mock reason for option {answer}."))
+        return outputs
+
+
+    # Answer every request of a wave
+    def generate_many(self, requests: list, timeout: float) -> list:
+        return [self.generate(request, timeout) for request in requests]
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+# Get the shared LLM backend of a run
+def get_llm_backend(ctx) -> object:
+    key = (ctx.llm_backend, ctx.local_base_url)
+    with _backends_lock:
+        if key not in _backends:
+            if ctx.llm_backend == "openai":
+                _backends[key] = OpenAIBackend()
+            elif ctx.llm_backend == "local":
+                _backends[key] = LocalBackend(ctx.local_base_url)
+            elif ctx.llm_backend == "mock":
+                _backends[key] = MockBackend()
+            else:
+                raise ValueError(f"Unknown LLM backend '{ctx.llm_backend}', expected one of {LLM_BACKENDS}")
+        return _backends[key]
@@ -0,0 +1,240 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from config_loader import load_config
+
+# Histogram bucket upper bounds
+latency_buckets = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, float('inf')]
+token_buckets = [64, 128, 256, 512, 1024, 2048, 4096, 8192, float('inf')]
+
+# Values gathered by the current thread during one call
+_call_state = threading.local()
+
+
+# Cumulative histogram with fixed buckets
+class Histogram:
+    def __init__(self, buckets: list):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+
+    # Add an observation
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+    # Cumulative (bound, count) pairs as used by Prometheus
+    def cumulative(self) -> list:
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+    # Histogram as a JSON serializable dict
+    def to_dict(self) -> dict:
+        buckets = {("+Inf" if bound == float('inf') else str(bound)): count for bound, count in self.cumulative()}
+        return {"count": self.count, "sum": round(self.sum, 4), "buckets": buckets}
+
+
+# Roll-up of every call made by one node or the whole run
+class CallStats:
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.cached_tokens = 0
+        self.errors = {}
+        self.latency = Histogram(latency_buckets)
+        self.prompt_tokens = Histogram(token_buckets)
+        self.completion_tokens = Histogram(token_buckets)
+
+
+    # Add a call record, counting calls answered without the LLM backend apart from LLM calls
+    def add(self, call: dict) -> None:
+        if call['cached']:
+            self.cache_hits += 1
+            return
+        self.calls += 1
+        self.retries += call['retries']
+        self.cached_tokens += call['cached_tokens']
+        self.latency.observe(call['wall_time'])
+        self.prompt_tokens.observe(call['prompt_tokens'])
+        self.completion_tokens.observe(call['completion_tokens'])
+        for error in call['retry_errors'] + ([call['error']] if call['error'] else []):
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+
+    # Roll-up as a JSON serializable dict
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "retries": self.retries,
+            "cached_tokens": self.cached_tokens,
+            "errors": self.errors,
+            "latency_seconds": self.latency.to_dict(),
+            "prompt_tokens": self.prompt_tokens.to_dict(),
+            "completion_tokens": self.completion_tokens.to_dict()
+        }
+
+
+# Collects tagged LLM call records into per-node and per-run roll-ups
+class MetricsCollector:
+    def __init__(self):
+        self.run = CallStats()
+        self.nodes = {}
+        self.lock = threading.Lock()
+        self.run_time = datetime.now().strftime("%m-%d,%H%M")
+        self.calls_file = None
+
+
+    # Add a call record and append it to the run's call log
+    def record(self, call: dict) -> None:
+        with self.lock:
+            self.run.add(call)
+            self.nodes.setdefault(call['community'], CallStats()).add(call)
+            if self.calls_file is None:
+                self.calls_file = open(f"{load_config()['output_path']}metrics_calls_{self.run_time}.jsonl", 'a')
+            self.calls_file.write(json.dumps(call) + "\n")
+
+
+    # Export roll-ups as JSON and Prometheus text next to the stats output
+    def export(self) -> None:
+        with self.lock:
+            if self.calls_file is not None:
+                self.calls_file.close()
+                self.calls_file = None
+            if self.run.calls == 0 and self.run.cache_hits == 0:
+                return
+
+            # JSON export
+            metrics = {"run": self.run.to_dict(), "nodes": {node: stats.to_dict() for node, stats in sorted(self.nodes.items())}}
+            with open(f"{load_config()['output_path']}metrics_{self.run_time}.json", 'w') as f:
+                json.dump(metrics, f, indent=4)
+
+            # Prometheus text export
+            with open(f"{load_config()['output_path']}metrics_{self.run_time}.prom", 'w') as f:
+                f.write(self.prometheus_text())
+
+
+    # Render roll-ups in the Prometheus text exposition format
+    def prometheus_text(self) -> str:
+        lines = []
+        series = [("mad_run", self.run, "")] + [("mad_node", stats, f'node="{node}"') for node, stats in sorted(self.nodes.items())]
+        for prefix in ["mad_run", "mad_node"]:
+            scoped = [(stats, labels) for series_prefix, stats, labels in series if series_prefix == prefix]
+
+            # Counters
+            for name, attr, help_text in [("llm_calls_total", "calls", "LLM calls"),
+                                          ("llm_cache_hits_total", "cache_hits", "Calls answered by the response cache or another sweep config"),
+                                          ("llm_retries_total", "retries", "LLM call retries"),
+                                          ("llm_cached_tokens_total", "cached_tokens", "Prompt tokens served from the provider cache")]:
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                for stats, labels in scoped:
+                    lines.append(f"{prefix}_{name}{{{labels}}} {getattr(stats, attr)}")
+            lines.append(f"# HELP {prefix}_llm_errors_total LLM call errors by class")
+            lines.append(f"# TYPE {prefix}_llm_errors_total counter")
+            for stats, labels in scoped:
+                for error, count in sorted(stats.errors.items()):
+                    error_labels = f'{labels},error="{error}"' if labels else f'error="{error}"'
+                    lines.append(f"{prefix}_llm_errors_total{{{error_labels}}} {count}")
+
+            # Histograms
+            for name, attr, help_text in [("llm_call_seconds", "latency", "Wall time of LLM calls"),
+                                          ("llm_prompt_tokens", "prompt_tokens", "Prompt tokens per LLM call"),
+                                          ("llm_completion_tokens", "completion_tokens", "Completion tokens per LLM call")]:
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                for stats, labels in scoped:
+                    histogram = getattr(stats, attr)
+                    sep = "," if labels else ""
+                    for bound, count in histogram.cumulative():
+                        le = "+Inf" if bound == float('inf') else str(bound)
+                        lines.append(f'{prefix}_{name}_bucket{{{labels}{sep}le="{le}"}} {count}')
+                    lines.append(f"{prefix}_{name}_sum{{{labels}}} {round(histogram.sum, 4)}")
+                    lines.append(f"{prefix}_{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+collector = MetricsCollector()
+
+
+# Check if call metrics are recorded for the active config
+def metrics_enabled() -> bool:
+    return load_config()['metrics']
+
+
+# Count a backoff retry of the current call
+def note_retry(details: dict) -> None:
+    if metrics_enabled() and getattr(_call_state, 'active', False):
+        # Use the original API error class if it was wrapped
+        exception = details.get('exception')
+        exception = exception.__cause__ if exception is not None and exception.__cause__ is not None else exception
+        _call_state.retries += 1
+        _call_state.retry_errors.append(type(exception).__name__)
+
+
+# Mark the current call as answered without querying the LLM backend
+def note_cache_hit() -> None:
+    if metrics_enabled() and getattr(_call_state, 'active', False):
+        _call_state.cached = True
+
+
+# Save token usage of the current call
+def note_usage(usage) -> None:
+    if metrics_enabled() and getattr(_call_state, 'active', False) and usage is not None:
+        _call_state.prompt_tokens = usage.prompt_tokens
+        _call_state.completion_tokens = usage.completion_tokens
+        details = getattr(usage, 'prompt_tokens_details', None)
+        _call_state.cached_tokens = (details.cached_tokens or 0) if details is not None else 0
+
+
+# Time an LLM call and record it with its tags
+@contextmanager
+def track_call(**tags):
+    if not metrics_enabled():
+        yield
+        return
+
+    # Reset per call values for this thread
+    _call_state.active = True
+    _call_state.retries = 0
+    _call_state.retry_errors = []
+    _call_state.prompt_tokens = 0
+    _call_state.completion_tokens = 0
+    _call_state.cached_tokens = 0
+    _call_state.cached = False
+    error = None
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _call_state.active = False
+        collector.record({
+            **tags,
+            "wall_time": round(time.perf_counter() - start, 4),
+            "prompt_tokens": _call_state.prompt_tokens,
+            "completion_tokens": _call_state.completion_tokens,
+            "cached_tokens": _call_state.cached_tokens,
+            "retries": _call_state.retries,
+            "retry_errors": _call_state.retry_errors,
+            "cached": _call_state.cached,
+            "error": error
+        })
@@ -0,0 +1,158 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Answer policies
+ANSWER_POLICIES = ["constant", "random", "majority"]
+
+
+# Parse a latency spec such as "fixed:0.2", "uniform:0.1,0.5" or "lognormal:-1.6,0.5" into a sampler
+def latency_sampler(spec: str, rng: random.Random):
+    name, _, args = spec.partition(":")
+    params = [float(arg) for arg in args.split(",")] if args else []
+    if name == "fixed":
+        return lambda: params[0] if params else 0.0
+    if name == "uniform":
+        return lambda: rng.uniform(params[0], params[1])
+    if name == "lognormal":
+        return lambda: rng.lognormvariate(params[0], params[1])
+    raise ValueError(f"Unknown latency distribution '{name}', expected fixed, uniform or lognormal")
+
+
+# Local stand-in for the OpenAI chat completions endpoint
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int=0, latency: str="fixed:0", rate_limit_rate: float=0.0, server_error_rate: float=0.0,
+                 answer_policy: str="constant", seed: int=0):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        if answer_policy not in ANSWER_POLICIES:
+            raise ValueError(f"Unknown answer policy '{answer_policy}', expected one of {ANSWER_POLICIES}")
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.sample_latency = latency_sampler(latency, self.rng)
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.answer_policy = answer_policy
+        self.requests = 0
+        self.completions = 0
+        self.counter_lock = threading.Lock()
+
+
+    # Base URL to point the OpenAI client at
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+    # Draw a random number under the lock shared by handler threads
+    def random(self) -> float:
+        with self.rng_lock:
+            return self.rng.random()
+
+
+    # Pick an answer for a request according to the answer policy
+    def choose_answer(self, messages: list) -> int:
+        if self.answer_policy == "constant":
+            return 1
+        if self.answer_policy == "majority":
+            # Follow the most common answer in the chat history if there is one
+            answers = re.findall(r": Chose (\d)", messages[-1]['content'])
+            if answers:
+                return int(Counter(answers).most_common(1)[0][0])
+        with self.rng_lock:
+            return self.rng.randint(1, 4)
+
+
+    # Start serving in a background thread
+    def start(self) -> 'MockOpenAIServer':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+# Request handler for the mock server
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+
+    # Silence per request logging
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+    # Send a JSON response
+    def send_json(self, status: int, body: dict, headers: dict={}) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    # Handle chat completion requests
+    def do_POST(self) -> None:
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        with server.counter_lock:
+            server.requests += 1
+
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        # Simulate latency and injected failures
+        time.sleep(server.sample_latency())
+        if server.random() < server.rate_limit_rate:
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                           {"retry-after-ms": "100", "x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "100ms"})
+            return
+        if server.random() < server.server_error_rate:
+            self.send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+
+        # Build one choice per requested sample
+        messages = request.get("messages", [])
+        choices = []
+        for i in range(request.get("n", 1)):
+            answer = server.choose_answer(messages)
+            content = json.dumps({"answer": answer, "reason": f"Mock reason for option {answer}."})
+            choices.append({"index": i, "finish_reason": "stop", "logprobs": None,
+                            "message": {"role": "assistant", "content": content, "refusal": None}})
+        with server.counter_lock:
+            server.completions += len(choices)
+
+        prompt_tokens = sum(len(message.get("content", "")) for message in messages) // 4
+        completion_tokens = 20 * len(choices)
+        self.send_json(200, {
+            "id": f"chatcmpl-mock-{server.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": choices,
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        }, {"x-ratelimit-remaining-requests": "10000", "x-ratelimit-remaining-tokens": "10000000"})
+
+
+# Run the mock server from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock of the OpenAI chat completions endpoint")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", default="fixed:0", help="fixed:S, uniform:LO,HI or lognormal:MU,SIGMA in seconds")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--answer-policy", choices=ANSWER_POLICIES, default="constant")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(args.port, args.latency, args.rate_limit_rate, args.server_error_rate, args.answer_policy, args.seed)
+    print(f"Mock OpenAI server listening on {server.base_url}")
+    server.serve_forever()
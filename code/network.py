@@ -1,59 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from node import Community, Judge
-
-# Load config
-from config_loader import load_config, load_network_config
-config = load_config()
-verbose = config['verbose']
-network_preset = config['network_preset']
+from topology import NetworkTopology
+from scheduler import question_counter, call_priority
+from tracer import span
 
 
 # Network class
 class Network:
-    def __init__(self, question: dict):
-        self.all_responses = []
-        self.judge = Judge(question)
+    def __init__(self, question: dict, topology: NetworkTopology, ctx):
+        self.topology = topology
+        self.ctx = ctx
+        self.question_id = question.get('id')
+        self.judge = Judge(question, ctx)
         self.communities = self.create_communities(question)
+        self.all_responses = [None] * len(self.communities)
+        self.on_node_complete = None
+
+        # Prioritize calls by the community's remaining depth to the judge, then by question age, and tag their trace spans
+        self.seq = next(question_counter)
+        for i, com in enumerate(self.communities):
+            com.network_seq = self.seq
+            for agent in com.agent_list + [com.community_judge]:
+                agent.priority = call_priority(topology.remaining_depth[i], self.seq)
+                agent.network_seq = self.seq
+        self.judge.judge.priority = call_priority(0, self.seq)
+        self.judge.network_seq = self.judge.judge.network_seq = self.seq
     
 
-    # Initialize communities in the network
+    # Initialize communities in the network from the compiled topology
     def create_communities(self, question: dict) -> list:
-        # Load network configuration
-        starting, matrix, temp_list = load_network_config(network_preset)
-
         # Create communities
         com_list = []
-        for i, temp in enumerate(temp_list):
-            start = True if starting[i] == 1 else False
-            C = Community(f"Community {i+1}", question, temp, start)
+        for i, temp in enumerate(self.topology.temperatures):
+            start = True if self.topology.starting[i] == 1 else False
+            C = Community(f"Community {i+1}", question, temp, start, self.ctx)
             com_list.append(C)
         
         # Temporarily add judge to the network for adding listeners
         com_list.append(self.judge)
 
         # Add listeners and senders
-        for from_node, row in enumerate(matrix):
-            for to_node, val in enumerate(row):
-                # Check if from and to nodes are different
-                if val == 1 and from_node != to_node:
-                    com_list[from_node].add_send(com_list[to_node])
+        for from_node, to_nodes in enumerate(self.topology.senders):
+            for to_node in to_nodes:
+                com_list[from_node].add_send(com_list[to_node])
         
         # Return list of communities minus judge
         return com_list[:-1]
+
+
+    # Restore communities completed in an earlier run and pass their answers on
+    def restore(self, completed: dict) -> None:
+        for index, chat_hist in completed.items():
+            com = self.communities[index]
+            com.chat_hist = list(chat_hist)
+            com.completed = True
+            com.listen_list = []
+            com.inbox = {}
+            self.all_responses[index] = com.chat_hist
+
+        # Feed restored final answers to communities that still need to run
+        for index in completed:
+            com = self.communities[index]
+            for target in com.send_list:
+                if not target.completed:
+                    target.listener(com.chat_hist[-1])
+
+
+    # Save a community's chat history under its network index
+    def complete_community(self, index: int, chat_hist: list) -> None:
+        self.all_responses[index] = chat_hist
+        if self.on_node_complete is not None:
+            self.on_node_complete(index, chat_hist)
     
     
+    # Run a community and save its chat history before passing its answer on, so the journal records senders first
+    def run_community(self, index: int) -> None:
+        com = self.communities[index]
+        print(f"\n======|| {com.name} ||======" if self.ctx.verbose else "", end='')
+        self.complete_community(index, com.run_community())
+        com.send()
+
+
+    # Check if every community has run or was restored from the journal
+    def communities_done(self) -> bool:
+        return all(chat_hist is not None for chat_hist in self.all_responses)
+
+
     # Run the network and return all responses
     def run_network(self) -> dict:
-        # Run until all listeners are satisfied
-        while not self.judge.check_listeners():
-            for com in self.communities:
+        with span("run_network", question=self.question_id, network=self.seq):
+            # Start every community as soon as its listeners are satisfied
+            with ThreadPoolExecutor(max_workers=max(1, self.ctx.max_concurrent_communities)) as executor:
+                # Wait for every community, not just the judge's senders, since restored communities can satisfy the judge early
+                running = set()
+                while not self.communities_done():
+                    for i, com in enumerate(self.communities):
+                        if com.check_listeners():
+                            running.add(executor.submit(self.run_community, i))
+
+                    # Stop if nothing is running and a community can never start
+                    if not running:
+                        raise RuntimeError("Network stalled before every community ran, check the network config.")
+
+                    # Wait for a community to finish before checking listeners again
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+
+            # Get final answer from all communities and judge
+            judge_response = self.judge.run_judge()
+            self.all_responses.append(judge_response)
+            print(f"      Judge Verdict: {judge_response['Answer']}\n\n" if self.ctx.verbose else "", end='')
+            return self.all_responses
+
+
+    # Generate one query wave across every running community, receiving the responses to each
+    def waves(self):
+        active = {}
+        while not self.communities_done():
+            # Start every community whose listeners are satisfied
+            for i, com in enumerate(self.communities):
                 if com.check_listeners():
-                    # Save agent answers and get community final responses
-                    print(f"\n======|| {com.name} ||======" if verbose else "", end='')
-                    community_answers = com.run_community()
-                    self.all_responses.append(community_answers)
+                    print(f"\n======|| {com.name} ||======" if self.ctx.verbose else "", end='')
+                    com_waves = com.waves()
+                    active[i] = [com_waves, next(com_waves)]
+
+            # Stop if nothing is running and a community can never start
+            if not active:
+                raise RuntimeError("Network stalled before every community ran, check the network config.")
+
+            # Combine pending requests from all running communities into one wave
+            responses = yield [request for _, requests in active.values() for request in requests]
+
+            # Hand each community its responses and finish completed communities
+            pos = 0
+            for i in list(active):
+                com_waves, requests = active[i]
+                com_responses = responses[pos:pos + len(requests)]
+                pos += len(requests)
+                try:
+                    active[i][1] = com_waves.send(com_responses)
+                except StopIteration as stop:
+                    self.complete_community(i, stop.value)
+                    self.communities[i].send()
+                    del active[i]
 
         # Get final answer from all communities and judge
-        judge_response = self.judge.run_judge()
+        judge_response = yield from self.judge.waves()
         self.all_responses.append(judge_response)
-        print(f"      Judge Verdict: {judge_response['Answer']}\n\n" if verbose else "", end='')
-        return self.all_responses
\ No newline at end of file
+        print(f"      Judge Verdict: {judge_response['Answer']}\n\n" if self.ctx.verbose else "", end='')
+        return self.all_responses
@@ -1,60 +1,72 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from agent import Agent
 from agent import CommunityJudge
+from agent import ask_sampled, shares_prompt
+from tracer import span
 
-# Load config
-from config_loader import load_config
-config = load_config()
-verbose = config['verbose']
-verbose_message_passing = config['verbose_message_passing']
-verbose_responses = config['verbose_responses']
-num_agents = config['num_agents']
-num_rounds = config['num_rounds']
-node_judge_temp = config['node_judge_temp']
+# Early exit rules
+EARLY_EXIT_RULES = ["none", "unanimous", "majority"]
 
 
 # Node class
 class Node:
-    def __init__(self, name: str, start: bool=False):
+    def __init__(self, name: str, ctx, start: bool=False):
         self.name = name
+        self.ctx = ctx
         self.listen_list = []
+        self.listen_order = []
+        self.inbox = {}
         self.send_list = []
         self.chat_hist = []
         self.completed = False
         self.start = start
+        self.lock = threading.Lock()
+        self.question_id = None
+        self.network_seq = None
 
 
     # Listen for response from other nodes
     def listener(self, response: dict):
-        if response['Name'] in self.listen_list:
-            print(f"\t{self.name} received {response['Name']}\n" if verbose_message_passing else "", end='')
-            self.listen_list.remove(response['Name'])
-            add_response = response.copy()
-            add_response['Name'] = f"Agent {len(self.chat_hist)+1}"
-            self.chat_hist.append(add_response)
-        else:
-            print(f"\n\n\nERROR: [{self.name}] listener for {response['Name']} not in listen_list.\n")
+        with self.lock:
+            if response['Name'] in self.listen_list:
+                print(f"\t{self.name} received {response['Name']}\n" if self.ctx.verbose_message_passing else "", end='')
+                self.listen_list.remove(response['Name'])
+                self.inbox[response['Name']] = response.copy()
+
+                # Add responses in listener order once all have arrived so chat history is deterministic
+                if len(self.listen_list) == 0:
+                    for sender in self.listen_order:
+                        add_response = self.inbox.pop(sender)
+                        add_response['Name'] = f"Agent {len(self.chat_hist)+1}"
+                        self.chat_hist.append(add_response)
+            else:
+                print(f"\n\n\nERROR: [{self.name}] listener for {response['Name']} not in listen_list.\n")
 
 
     # Check if node is ready to run
     def check_listeners(self) -> bool:
-        # Check if node is a starting node
-        if self.start and not self.completed:
-            self.completed = True
-            return True
-        
-        # Check if ready to run the node
-        if len(self.listen_list) == 0 and not self.completed:
-            # Check if there are listening nodes or if the node is a judge
-            if len(self.send_list) > 0 or self.name == 'Judge':
+        with self.lock:
+            # Check if node is a starting node
+            if self.start and not self.completed:
                 self.completed = True
                 return True
-        
-        return False
+            
+            # Check if ready to run the node
+            if len(self.listen_list) == 0 and not self.completed:
+                # Check if there are listening nodes or if the node is a judge
+                if len(self.send_list) > 0 or self.name == 'Judge':
+                    self.completed = True
+                    return True
+            
+            return False
     
 
     # Add listener to listen_list
     def add_listener(self, community_name: str) -> None:
         self.listen_list.append(community_name)
+        self.listen_order.append(community_name)
     
     
     # Add community to send_list
@@ -65,49 +77,96 @@ class Node:
 
 # Community class
 class Community(Node):
-    def __init__(self, name: str, question: dict, temperature: float, start: bool):
-        super().__init__(name, start)
+    def __init__(self, name: str, question: dict, temperature: float, start: bool, ctx):
+        super().__init__(name, ctx, start)
+        self.question_id = question.get('id')
         self.agent_list = self.create_agents(question, temperature)
-        self.community_judge = CommunityJudge(question, name)
+        self.community_judge = CommunityJudge(question, ctx, name)
+        self.consensus = None
         
 
     # Initialize agents in the community
     def create_agents(self, question: dict, temperature: float) -> list:
         agent_list = []
-        for i in range(num_agents):
-            agent = Agent(f"Agent {chr(65 + i)}", question, temperature)
+        for i in range(self.ctx.num_agents):
+            agent = Agent(f"Agent {chr(65 + i)}", question, self.ctx, temperature, self.name)
             agent_list.append(agent)
         return agent_list
     
 
-    # Run MAD and query agents
-    def debate(self) -> None:
+    # Generate a query wave for each agent turn, receiving the responses to each
+    def debate(self):
+        ctx = self.ctx
+        round_answers = []
+
         # Iterate through agents for num_rounds
-        for i in range(num_rounds):
-            print(f"\n  [ Round {i+1} ]\n" if verbose else "", end='')
+        for i in range(ctx.num_rounds):
+            print(f"\n  [ Round {i+1} ]\n" if ctx.verbose else "", end='')
             for agent in self.agent_list:
-                # Get response from agent
-                response = agent.ask(self.chat_hist)
-                self.chat_hist.append(response)
-                print(f"{response['Name']}: Option {response['Answer']}\n" if verbose else "", end='')
-                print(f"   {response['Reason']}\n\n" if verbose_responses else "", end='')
-
-
-    # Perform community functions
-    def run_community(self) -> list:
+                agent.round_num = i + 1
+            with span("round", question=self.question_id, network=self.network_seq, community=self.name, round=i + 1):
+                if ctx.simultaneous_rounds:
+                    # Query all agents at once on the same snapshot of the chat history
+                    snapshot = list(self.chat_hist)
+                    responses = yield [(agent, snapshot) for agent in self.agent_list]
+                    self.chat_hist.extend(responses)
+                else:
+                    # Query agents one at a time, each seeing the responses before it
+                    responses = []
+                    for agent in self.agent_list:
+                        response = (yield [(agent, self.chat_hist)])[0]
+                        self.chat_hist.append(response)
+                        responses.append(response)
+
+            # Print agent responses
+            for response in responses:
+                print(f"{response['Name']}: Option {response['Answer']}\n" if ctx.verbose else "", end='')
+                print(f"   {response['Reason']}\n\n" if ctx.verbose_responses else "", end='')
+
+            # Stop debating once agents reach consensus
+            round_answers.append([response['Answer'] for response in responses])
+            self.consensus = check_consensus(round_answers, ctx.early_exit_rule, ctx.early_exit_k)
+            if self.consensus is not None:
+                self.skip_rounds(responses, ctx.num_rounds - i - 1)
+                break
+
+
+    # Carry each agent's last response forward for skipped rounds so every round is recorded
+    def skip_rounds(self, responses: list, rounds: int) -> None:
+        print(f"\n  [ Consensus on Option {self.consensus}, skipping {rounds} rounds ]\n" if self.ctx.verbose and rounds else "", end='')
+        for _ in range(rounds):
+            for response in responses:
+                self.chat_hist.append({**response, "Skipped": True})
+
+
+    # Generate every query wave of the community and return its chat history
+    def waves(self):
         # Get answers from agents
-        self.debate()
+        yield from self.debate()
         
-        # Get final judge answer for community
-        final_answer = self.community_judge.ask(self.chat_hist[-num_agents:])
+        # Get final judge answer for community, skipping the judge if agents reached consensus
+        if self.consensus is not None:
+            final_answer = {"Name": self.name, "Answer": self.consensus, "Reason": f"Skipped judge, agents reached consensus on option {self.consensus}.", "Skipped": True}
+        else:
+            final_answer = (yield [(self.community_judge, self.chat_hist[-self.ctx.num_agents:])])[0]
         self.chat_hist.append(final_answer)
-        print(f"\n + {self.name} Judge chose Option {final_answer['Answer']} +\n" if verbose else "", end='')
-        print(f"   {final_answer['Reason']}\n" if verbose_responses else "", end='')
+        print(f"\n + {self.name} Judge chose Option {final_answer['Answer']} +\n" if self.ctx.verbose else "", end='')
+        print(f"   {final_answer['Reason']}\n" if self.ctx.verbose_responses else "", end='')
+        return self.chat_hist
+
 
-        # Feed response to communities
-        print(f"\n-- {self.name} sending to: {', '.join(com.name for com in self.send_list)}\n" if verbose_message_passing else "", end='')
+    # Feed final answer to listening communities, skipping communities restored from the journal
+    def send(self) -> None:
+        print(f"\n-- {self.name} sending to: {', '.join(com.name for com in self.send_list)}\n" if self.ctx.verbose_message_passing else "", end='')
         for community in self.send_list:
-            community.listener(final_answer)
+            if not community.completed:
+                community.listener(self.chat_hist[-1])
+
+
+    # Perform community functions, leaving sending the final answer to the caller
+    def run_community(self) -> list:
+        with span("run_community", question=self.question_id, network=self.network_seq, community=self.name, after=list(self.listen_order)):
+            run_waves(self.waves())
 
         # Return entire chat history for stat tracking
         return self.chat_hist
@@ -115,12 +174,70 @@ class Community(Node):
 
 # Judge class
 class Judge(Node):
-    def __init__(self, question: dict, name: str='Judge'):
-        super().__init__(name=name)
-        self.judge = CommunityJudge(question, name, node_judge_temp)
+    def __init__(self, question: dict, ctx, name: str='Judge'):
+        super().__init__(name, ctx)
+        self.question_id = question.get('id')
+        self.judge = CommunityJudge(question, ctx, name, ctx.node_judge_temp)
     
 
+    # Generate the judge query wave and return the verdict
+    def waves(self):
+        # Skip judge if every community verdict agrees
+        answers = set(response['Answer'] for response in self.chat_hist)
+        if self.ctx.skip_network_judge and len(answers) == 1 and 0 not in answers:
+            answer = answers.pop()
+            print(f"\n <<< Skipping Judge node, communities agree on Option {answer} >>>\n" if self.ctx.verbose else "", end='')
+            return {"Name": self.name, "Answer": answer, "Reason": f"Skipped judge, communities agreed on option {answer}.", "Skipped": True}
+
+        print("\n <<< Running Judge node >>>\n" if self.ctx.verbose else "", end='')
+        return (yield [(self.judge, self.chat_hist)])[0]
+
+
     # Run judge node
     def run_judge(self) -> dict:
-        print("\n <<< Running Judge node >>>\n" if verbose else "", end='')
-        return self.judge.ask(self.chat_hist)
\ No newline at end of file
+        with span("run_judge", question=self.question_id, network=self.network_seq, community=self.name, after=list(self.listen_order)):
+            return run_waves(self.waves())
+
+
+# Get the consensus answer of the debate rounds so far, or None if there isn't one yet
+def check_consensus(round_answers: list, early_exit_rule: str, early_exit_k: int) -> int:
+    if early_exit_rule not in EARLY_EXIT_RULES:
+        raise ValueError(f"Unknown early exit rule '{early_exit_rule}', expected one of {EARLY_EXIT_RULES}")
+
+    # All agents agree in the latest round
+    if early_exit_rule == "unanimous":
+        answers = set(round_answers[-1])
+        return answers.pop() if len(answers) == 1 and 0 not in answers else None
+
+    # At least k agents agree on the same answer in each of the last two rounds, ignoring abstains
+    if early_exit_rule == "majority" and len(round_answers) >= 2:
+        majorities = []
+        for answers in round_answers[-2:]:
+            votes = Counter(answer for answer in answers if answer != 0)
+            answer, count = votes.most_common(1)[0] if votes else (None, 0)
+            majorities.append(answer if count >= early_exit_k else None)
+        if majorities[0] is not None and majorities[0] == majorities[1]:
+            return majorities[0]
+    return None
+
+
+# Answer each query wave of a generator and return its result
+def run_waves(waves) -> object:
+    try:
+        requests = next(waves)
+        while True:
+            requests = waves.send(ask_all(requests))
+    except StopIteration as stop:
+        return stop.value
+
+
+# Ask every agent in a wave, at the same time if there are several
+def ask_all(requests: list) -> list:
+    if len(requests) == 1:
+        agent, chat_hist = requests[0]
+        return [agent.ask(chat_hist)]
+    # Ask agents sharing a prompt with one sampled request
+    if requests[0][0].ctx.sample_agents and shares_prompt(requests):
+        return ask_sampled([agent for agent, _ in requests], requests[0][1])
+    with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+        return list(executor.map(lambda request: request[0].ask(request[1]), requests))
@@ -0,0 +1,129 @@
+import re
+import threading
+import time
+from config_loader import load_config
+from tracer import span
+
+# Rough estimate of completion tokens for a Format response
+completion_token_estimate = 200
+
+
+# Token bucket refilled continuously up to a per minute capacity
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+
+    # Refill bucket based on time elapsed since the last update
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+    # Seconds until the bucket holds the given amount
+    def wait_time(self, amount: float) -> float:
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+# Requests and tokens per minute limiter shared by every caller of a model
+class RateLimiter:
+    def __init__(self, model_name: str, rpm: float, tpm: float, headroom: float):
+        self.model_name = model_name
+        self.requests = TokenBucket(rpm * headroom)
+        self.tokens = TokenBucket(tpm * headroom)
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+
+    # Block until a request of the estimated token size fits under quota
+    def acquire(self, tokens: int) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens), self.blocked_until - now)
+                if wait <= 0:
+                    self.requests.level -= 1
+                    self.tokens.level -= tokens
+                    return
+            with span("rate_limit_wait", model=self.model_name):
+                time.sleep(wait)
+
+
+    # Correct the token bucket once actual usage is known
+    def record_usage(self, estimated: int, actual: int) -> None:
+        with self.lock:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated - actual)
+
+
+    # Adapt to the rate limit and retry-after headers of a response
+    def update_from_headers(self, headers) -> None:
+        with self.lock:
+            now = time.monotonic()
+            remaining_requests = headers.get('x-ratelimit-remaining-requests')
+            remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+            if remaining_requests is not None:
+                self.requests.level = min(self.requests.level, float(remaining_requests))
+            if remaining_tokens is not None:
+                self.tokens.level = min(self.tokens.level, float(remaining_tokens))
+
+            # Hold all callers until the server says the quota has reset
+            retry_after = parse_retry_after(headers)
+            if retry_after is None and remaining_requests is not None and float(remaining_requests) <= 0:
+                retry_after = parse_duration(headers.get('x-ratelimit-reset-requests', ''))
+            if retry_after is None and remaining_tokens is not None and float(remaining_tokens) <= 0:
+                retry_after = parse_duration(headers.get('x-ratelimit-reset-tokens', ''))
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+
+# Parse retry-after headers into seconds
+def parse_retry_after(headers) -> float:
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get('retry-after')
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return None
+
+
+# Parse OpenAI reset durations such as "20ms", "1s" or "6m0s" into seconds
+def parse_duration(duration: str) -> float:
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", duration)
+    if not parts:
+        return None
+    return sum(float(value) * units[unit] for value, unit in parts)
+
+
+# Estimate tokens of a request from its messages
+def estimate_tokens(messages: list) -> int:
+    chars = sum(len(message['content']) for message in messages)
+    return chars // 4 + completion_token_estimate
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# Get the process-wide rate limiter for a model
+def get_rate_limiter(model_name: str) -> RateLimiter:
+    with _limiters_lock:
+        if model_name not in _limiters:
+            config = load_config()
+            limits = config['rate_limits'].get(model_name, config['rate_limits']['default'])
+            _limiters[model_name] = RateLimiter(model_name, limits['rpm'], limits['tpm'], config['rate_limit_headroom'])
+        return _limiters[model_name]
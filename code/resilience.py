@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config_loader import load_config
+
+# Number of recent latencies kept per model for hedging
+latency_window = 200
+
+# Threads running hedged duplicate requests
+hedge_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="hedge")
+
+
+# Raised when a model's circuit breaker is open
+class CircuitOpenError(Exception):
+    pass
+
+
+# Process-wide budget that allows retries only as a fraction of requests
+class RetryBudget:
+    def __init__(self, ratio: float, minimum: float):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.tokens = minimum
+        self.lock = threading.Lock()
+
+
+    # Earn a fraction of a retry for every successful request, up to the starting budget
+    def record_success(self) -> None:
+        with self.lock:
+            self.tokens = min(self.tokens + self.ratio, self.minimum)
+
+
+    # Spend a retry, returning False if the budget is exhausted
+    def acquire(self) -> bool:
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+# Per model circuit breaker that stops calls after repeated failures
+class CircuitBreaker:
+    def __init__(self, model_name: str, failure_threshold: int, reset_time: float):
+        self.model_name = model_name
+        self.failure_threshold = failure_threshold
+        self.reset_time = reset_time
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+
+    # Check if a call may go through, letting one probe call through after the reset time
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= self.reset_time:
+                self.probing = True
+                return True
+            return False
+
+
+    # Close the circuit after a successful call
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+
+    # Count a failed call and open the circuit past the threshold
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+# Recent call latencies of a model
+class LatencyTracker:
+    def __init__(self, min_samples: int):
+        self.latencies = deque(maxlen=latency_window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+
+    # Add a successful call latency
+    def add(self, latency: float) -> None:
+        with self.lock:
+            self.latencies.append(latency)
+
+
+    # Latency percentile, or None until there are enough samples
+    def percentile(self, pct: float) -> float:
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+_retry_budget = None
+_breakers = {}
+_trackers = {}
+_registry_lock = threading.Lock()
+
+
+# Get the process-wide retry budget
+def get_retry_budget() -> RetryBudget:
+    global _retry_budget
+    with _registry_lock:
+        if _retry_budget is None:
+            config = load_config()
+            _retry_budget = RetryBudget(config['retry_budget_ratio'], config['retry_budget_min'])
+        return _retry_budget
+
+
+# Get the circuit breaker for a model
+def get_circuit_breaker(model_name: str) -> CircuitBreaker:
+    with _registry_lock:
+        if model_name not in _breakers:
+            config = load_config()
+            _breakers[model_name] = CircuitBreaker(model_name, config['circuit_failure_threshold'], config['circuit_reset_time'])
+        return _breakers[model_name]
+
+
+# Get the latency tracker for a model
+def get_latency_tracker(model_name: str) -> LatencyTracker:
+    with _registry_lock:
+        if model_name not in _trackers:
+            _trackers[model_name] = LatencyTracker(load_config()['hedge_min_samples'])
+        return _trackers[model_name]
+
+
+# Backoff giveup check of one call that spends the retry budget only when another try would run, and stops when it runs out
+def retry_budget_giveup(max_tries: int, max_time: float):
+    tries = 0
+    start = time.monotonic()
+
+    # Backoff calls this after every failed try, including the last one
+    def giveup(exception: Exception) -> bool:
+        nonlocal tries
+        tries += 1
+        if tries >= max_tries or time.monotonic() - start >= max_time:
+            return True
+        return not get_retry_budget().acquire()
+    return giveup
+
+
+# Run a call, firing a duplicate through hedge_fn once it runs past the model's latency percentile, and return the first success
+def hedged_call(fn, model_name: str, hedge_fn=None) -> object:
+    tracker = get_latency_tracker(model_name)
+    delay = tracker.percentile(load_config()['hedge_percentile'])
+
+    # Time the call so later hedges know the latency distribution
+    def timed_fn(call):
+        start = time.monotonic()
+        result = call()
+        tracker.add(time.monotonic() - start)
+        return result
+
+    if delay is None:
+        return timed_fn(fn)
+
+    # Fire a duplicate if the first call is slow
+    futures = {hedge_executor.submit(timed_fn, fn)}
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        futures.add(hedge_executor.submit(timed_fn, hedge_fn or fn))
+
+    # Take whichever call succeeds first
+    error = None
+    while futures:
+        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from config_loader import load_config
+
+# Cache modes
+CACHE_MODES = ["off", "record", "replay", "read-through"]
+
+# Number of writes between evictions
+evict_interval = 100
+
+
+# Raised in replay mode when a response is not cached
+class CacheMiss(Exception):
+    pass
+
+
+# Disk-backed LLM response cache keyed on the request contents
+class ResponseCache:
+    def __init__(self, path: str, mode: str, max_entries: int, max_age_days: float):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode '{mode}', expected one of {CACHE_MODES}")
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                model TEXT,
+                                answer INTEGER,
+                                reason TEXT,
+                                created REAL,
+                                last_used REAL
+                             )""")
+        self.conn.commit()
+        self.evict()
+
+
+    # Hash the model, temperature, node, sample index and messages of a request
+    @staticmethod
+    def make_key(model_name: str, temperature: float, node_name: str, sample_index: int, messages: list) -> str:
+        messages_hash = hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()
+        key = json.dumps([model_name, temperature, node_name, sample_index, messages_hash])
+        return hashlib.sha256(key.encode()).hexdigest()
+
+
+    # Get cached output for a key
+    def get(self, key: str) -> dict:
+        with self.lock:
+            row = self.conn.execute("SELECT answer, reason FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        return {"answer": row[0], "reason": row[1]}
+
+
+    # Save output for a key
+    def put(self, key: str, model_name: str, output: dict) -> None:
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                              (key, model_name, output['answer'], output['reason'], now, now))
+            self.conn.commit()
+            self.writes += 1
+        if self.writes % evict_interval == 0:
+            self.evict()
+
+
+    # Remove entries past the max age, then least recently used entries past the max size
+    def evict(self) -> None:
+        with self.lock:
+            if self.max_age > 0:
+                self.conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+            if self.max_entries > 0:
+                self.conn.execute("""DELETE FROM responses WHERE key IN (
+                                        SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                                     )""", (self.max_entries,))
+            self.conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# Get the process-wide response cache, or None if caching is off
+def get_response_cache() -> ResponseCache:
+    global _cache
+    config = load_config()
+    if config['cache_mode'] == "off":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(config['cache_path'], config['cache_mode'], config['cache_max_entries'], config['cache_max_age_days'])
+        return _cache
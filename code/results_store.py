@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+from array import array
+
+# Response roles
+ROLE_UPSTREAM = 0
+ROLE_AGENT = 1
+ROLE_COMMUNITY_JUDGE = 2
+ROLE_NETWORK_JUDGE = 3
+
+# Response flags
+FLAG_SKIPPED = 1
+FLAG_ABSTAINED = 2
+
+# Integer columns, one row per response
+COLUMNS = ["question", "community", "round", "agent", "role", "answer", "flags"]
+
+
+# Columnar store of every response of a run, with reasons kept in a separate blob file
+class ResultsStore:
+    def __init__(self, path: str, num_agents: int, num_communities: int, num_upstream: list):
+        self.path = path
+        self.num_agents = num_agents
+        self.num_communities = num_communities
+        self.num_upstream = num_upstream
+        self.columns = {name: array('i') for name in COLUMNS}
+
+        # Reason blob offsets per row, and original id and correct answer per question
+        self.columns['reason_offsets'] = array('q')
+        self.columns['question_ids'] = array('q')
+        self.columns['correct_answers'] = array('i')
+        self.reasons_file = None
+
+
+    # Create an empty store for a run's network, writing reasons to disk as responses are added
+    @classmethod
+    def create(cls, path: str, topology, num_agents: int) -> 'ResultsStore':
+        store = cls(path, num_agents, topology.num_communities, [len(topology.listeners[i]) for i in range(topology.num_communities)])
+        store.reasons_file = open(f"{path}.reasons", 'wb')
+        store.columns['reason_offsets'].append(0)
+        return store
+
+
+    # Add a row and write its reason to the blob file
+    def add_row(self, question: int, community: int, round_num: int, agent: int, role: int, response: dict) -> None:
+        flags = (FLAG_SKIPPED if response.get('Skipped') else 0) | (FLAG_ABSTAINED if response.get('Abstained') else 0)
+        for name, value in zip(COLUMNS, [question, community, round_num, agent, role, response['Answer'], flags]):
+            self.columns[name].append(value)
+        self.reasons_file.write(response['Reason'].encode('utf-8'))
+        self.columns['reason_offsets'].append(self.reasons_file.tell())
+
+
+    # Add every response of one question
+    def add(self, question_id: int, correct_answer: int, all_responses: list) -> None:
+        question = self.num_questions()
+        self.columns['question_ids'].append(question_id)
+        self.columns['correct_answers'].append(correct_answer)
+
+        # Community chat histories are upstream answers, then each round of agents, then the community judge
+        for community, chat_hist in enumerate(all_responses[:-1]):
+            upstream = self.num_upstream[community]
+            for i, response in enumerate(chat_hist[:-1]):
+                if i < upstream:
+                    self.add_row(question, community, 0, -1, ROLE_UPSTREAM, response)
+                else:
+                    round_num, agent = divmod(i - upstream, self.num_agents)
+                    self.add_row(question, community, round_num + 1, agent, ROLE_AGENT, response)
+            self.add_row(question, community, 0, -1, ROLE_COMMUNITY_JUDGE, chat_hist[-1])
+        self.add_row(question, -1, 0, -1, ROLE_NETWORK_JUDGE, all_responses[-1])
+
+
+    # Write the columns next to the reasons blob
+    def save(self) -> None:
+        import numpy as np
+        self.reasons_file.flush()
+        np.savez(f"{self.path}.tmp.npz", **{name: np.asarray(column) for name, column in self.columns.items()},
+                 meta=np.array([self.num_agents, self.num_communities, *self.num_upstream], dtype=np.int32))
+        os.replace(f"{self.path}.tmp.npz", f"{self.path}.npz")
+
+
+    # Close the reasons blob after saving
+    def close(self) -> None:
+        self.save()
+        self.reasons_file.close()
+
+
+    # Load a saved store, leaving reasons on disk until they are read
+    @classmethod
+    def load(cls, path: str) -> 'ResultsStore':
+        import numpy as np
+        with np.load(f"{path}.npz") as data:
+            arrays = {name: data[name] for name in data.files}
+        meta = arrays.pop('meta')
+        store = cls(path, int(meta[0]), int(meta[1]), [int(n) for n in meta[2:]])
+        store.columns = arrays
+        return store
+
+
+    # Column as a NumPy array, copying the buffer of a store that is still being filled so it can keep growing
+    def column(self, name: str):
+        import numpy as np
+        column = self.columns[name]
+        return np.array(column) if isinstance(column, array) else column
+
+
+    # Number of responses
+    def __len__(self) -> int:
+        return len(self.columns['answer'])
+
+
+    # Number of questions
+    def num_questions(self) -> int:
+        return len(self.columns['question_ids'])
+
+
+    # Reason text of a row, read from the blob file on demand
+    def reason(self, row: int) -> str:
+        offsets = self.columns['reason_offsets']
+        if self.reasons_file is not None:
+            self.reasons_file.flush()
+        with open(f"{self.path}.reasons", 'rb') as f:
+            f.seek(offsets[row])
+            return f.read(offsets[row + 1] - offsets[row]).decode('utf-8')
+
+
+    # Whether each row's answer is the question's correct answer
+    def correct(self):
+        return self.column('answer') == self.column('correct_answers')[self.column('question')]
+
+
+# Accuracy of agent responses by agent letter and by round
+def agent_accuracy(store: ResultsStore) -> dict:
+    import numpy as np
+    agents = store.column('role') == ROLE_AGENT
+    correct = store.correct()[agents]
+    agent, round_num = store.column('agent')[agents], store.column('round')[agents]
+
+    # Count correct and total responses of each agent and of each round
+    by_agent = np.bincount(agent[correct], minlength=store.num_agents) / np.maximum(np.bincount(agent, minlength=store.num_agents), 1)
+    num_rounds = int(round_num.max(initial=0)) + 1
+    by_round = (np.bincount(round_num[correct], minlength=num_rounds) / np.maximum(np.bincount(round_num, minlength=num_rounds), 1))[1:]
+    return {'agent': {f"Agent {chr(65 + i)}": round(float(accuracy), 4) for i, accuracy in enumerate(by_agent)},
+            'round': {i + 1: round(float(accuracy), 4) for i, accuracy in enumerate(by_round)}}
+
+
+# Answers of every agent as a (question, community, agent, round) array, 0 where there is no answer
+def answer_cube(store: ResultsStore):
+    import numpy as np
+    agents = store.column('role') == ROLE_AGENT
+    num_rounds = int(store.column('round')[agents].max(initial=0))
+    cube = np.zeros((store.num_questions(), store.num_communities, store.num_agents, num_rounds), dtype=np.int32)
+    cube[store.column('question')[agents], store.column('community')[agents],
+         store.column('agent')[agents], store.column('round')[agents] - 1] = store.column('answer')[agents]
+    return cube
+
+
+# Fraction of agents changing their answer between consecutive rounds, ignoring abstains
+def flip_rates(store: ResultsStore) -> dict:
+    cube = answer_cube(store)
+    rates = {}
+    for r in range(cube.shape[3] - 1):
+        before, after = cube[..., r], cube[..., r + 1]
+        answered = (before > 0) & (after > 0)
+        rates[f"{r + 1}->{r + 2}"] = round(float((before != after)[answered].mean()), 4) if answered.any() else 0.0
+    return rates
+
+
+# Fraction of questions on which each pair of communities gave the same final answer
+def agreement_matrix(store: ResultsStore):
+    import numpy as np
+    judges = store.column('role') == ROLE_COMMUNITY_JUDGE
+    num_questions = store.num_questions()
+    finals = np.zeros((num_questions, store.num_communities), dtype=np.int32)
+    finals[store.column('question')[judges], store.column('community')[judges]] = store.column('answer')[judges]
+
+    # Count matching answers of every community pair at once through one-hot answers
+    one_hot = (finals[:, :, None] == np.arange(1, 5)[None, None, :]).astype(np.float64)
+    return np.einsum('qik,qjk->ij', one_hot, one_hot) / max(num_questions, 1)
+
+
+# Print analytics of a saved store from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analytics over a saved columnar results store")
+    parser.add_argument("path", help="results store path without the .npz extension")
+    args = parser.parse_args()
+
+    import numpy as np
+    store = ResultsStore.load(args.path)
+    judges = store.column('role') == ROLE_NETWORK_JUDGE
+    print(f"Responses: {len(store)}, questions: {store.num_questions()}, judge accuracy: {round(float(store.correct()[judges].mean()), 4)}")
+    print(json.dumps({'accuracy': agent_accuracy(store), 'flip_rates': flip_rates(store)}, indent=4))
+    print("Community agreement:")
+    print(np.array2string(agreement_matrix(store), precision=3))
@@ -0,0 +1,49 @@
+from config_loader import read_config, set_config
+from history import HistorySavings
+from scheduler import SlotUsage
+
+
+# Settings of one run, handed to MADCommunity, Network, Community and Agent
+class RunContext:
+    def __init__(self, config: dict):
+        self.config = config
+        self.shared_calls = None
+        self._topology = None
+
+        # Tokens saved by history windowing and call slot usage of this run alone
+        self.history_savings = HistorySavings()
+        self.slot_usage = SlotUsage()
+
+
+    # Build the context from a config file with KEY=VALUE overrides and make it the active config
+    @classmethod
+    def from_file(cls, path: str=None, overrides: list=[]) -> 'RunContext':
+        config = read_config(path, overrides)
+        set_config(config)
+        return cls(config)
+
+
+    # Read config values as attributes
+    def __getattr__(self, key: str):
+        try:
+            return self.__dict__['config'][key]
+        except KeyError:
+            raise AttributeError(f"Config has no key '{key}'") from None
+
+
+    # Network topology of the configured preset, parsed on first use
+    @property
+    def topology(self):
+        if self._topology is None:
+            from topology import NetworkTopology
+            self._topology = NetworkTopology.from_preset(self.config['network_preset'])
+
+            # Run every community at the same temperature if one is set
+            if self.config['community_temperature'] is not None:
+                self._topology.temperatures = [self.config['community_temperature']] * self._topology.num_communities
+        return self._topology
+
+
+    # Copy of the context with some config values replaced
+    def with_overrides(self, **overrides) -> 'RunContext':
+        return RunContext({**self.config, **overrides})
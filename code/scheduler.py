@@ -0,0 +1,144 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from config_loader import load_config
+from tracer import span
+
+# Call priority orders
+SCHEDULER_PRIORITIES = ["age_first", "depth_first"]
+
+# Order in which questions started
+question_counter = itertools.count()
+
+
+# Calls that went through the scheduler and how long they queued, for the whole pool or one run
+class SlotUsage:
+    def __init__(self):
+        self.calls = 0
+        self.queued_calls = 0
+        self.queue_depth_sum = 0
+        self.max_queue_depth = 0
+        self.wait_time = 0.0
+
+
+    # Queue depth and wait stats of the calls
+    def to_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'queued_calls': self.queued_calls,
+            'mean_queue_depth': round(self.queue_depth_sum / self.calls, 2) if self.calls else 0.0,
+            'max_queue_depth': self.max_queue_depth,
+            'mean_wait': round(self.wait_time / self.queued_calls, 3) if self.queued_calls else 0.0
+        }
+
+
+# Global pool of in-flight LLM call slots handed out by priority instead of arrival order
+class CallScheduler:
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.busy = 0
+        self.waiting = []
+        self.arrivals = itertools.count()
+        self.lock = threading.Lock()
+
+        # Queue depth and utilization stats
+        self.started = time.monotonic()
+        self.last_change = self.started
+        self.busy_time = 0.0
+        self.usage = SlotUsage()
+
+
+    # Hold a slot for the duration of a call, also counting it in a run's own usage if given
+    @contextmanager
+    def slot(self, priority: tuple, usage: SlotUsage=None):
+        self.acquire(priority, usage)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+    # Wait for a slot, lowest priority tuple first
+    def acquire(self, priority: tuple, usage: SlotUsage=None) -> None:
+        usages = [self.usage] if usage is None else [self.usage, usage]
+        with self.lock:
+            for counts in usages:
+                counts.calls += 1
+                counts.queue_depth_sum += len(self.waiting)
+            if self.busy < self.slots and not self.waiting:
+                self.update_busy(1)
+                return
+            entry = (priority, next(self.arrivals), threading.Event())
+            heapq.heappush(self.waiting, entry)
+            for counts in usages:
+                counts.queued_calls += 1
+                counts.max_queue_depth = max(counts.max_queue_depth, len(self.waiting))
+
+        # The releasing call hands its slot straight to the first waiter
+        start = time.monotonic()
+        with span("slot_wait", priority=list(priority)):
+            entry[2].wait()
+        with self.lock:
+            for counts in usages:
+                counts.wait_time += time.monotonic() - start
+
+
+    # Give the slot to the highest priority waiter, or free it
+    def release(self) -> None:
+        with self.lock:
+            if self.waiting:
+                heapq.heappop(self.waiting)[2].set()
+            else:
+                self.update_busy(-1)
+
+
+    # Change the busy slot count, adding up busy slot time for utilization
+    def update_busy(self, change: int) -> None:
+        now = time.monotonic()
+        self.busy_time += self.busy * (now - self.last_change)
+        self.last_change = now
+        self.busy += change
+
+
+    # Queue depth of all calls or of one run's calls, and utilization of the whole pool so far
+    def stats(self, usage: SlotUsage=None) -> dict:
+        with self.lock:
+            self.update_busy(0)
+            elapsed = max(self.last_change - self.started, 1e-9)
+            return {
+                'slots': self.slots,
+                **(self.usage if usage is None else usage).to_dict(),
+                'utilization': round(self.busy_time / (self.slots * elapsed), 3)
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# Get the process-wide call scheduler, or None if calls aren't scheduled
+def get_scheduler() -> CallScheduler:
+    global _scheduler
+    slots = load_config()['llm_call_slots']
+    if slots <= 0:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = CallScheduler(slots)
+        return _scheduler
+
+
+# Priority of a call from its community's remaining depth to the judge and its question's age
+def call_priority(remaining_depth: int, question_seq: int) -> tuple:
+    order = load_config()['scheduler_priority']
+    if order not in SCHEDULER_PRIORITIES:
+        raise ValueError(f"Unknown scheduler priority '{order}', expected one of {SCHEDULER_PRIORITIES}")
+
+    # Deepest remaining path first, then oldest question
+    if order == "depth_first":
+        return (-remaining_depth, question_seq)
+
+    # Oldest question first so started networks finish, then its deepest remaining path
+    return (question_seq, -remaining_depth)
@@ -0,0 +1,237 @@
+import argparse
+import importlib
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from run_context import RunContext
+from stats import StatsAggregator
+from metrics import collector
+from tracer import tracer
+from config_loader import set_config
+
+
+# Work queue of question shards leased to workers, kept in SQLite on storage shared by every worker
+class ShardQueue:
+    def __init__(self, path: str, lease_time: float=120, max_attempts: int=3):
+        self.path = path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS shards (
+                                id INTEGER PRIMARY KEY,
+                                question_ids TEXT,
+                                status TEXT,
+                                worker TEXT,
+                                lease_expires REAL,
+                                attempts INTEGER,
+                                stats_path TEXT
+                             )""")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+
+    # Fill the queue with shards of question ids and the config every worker runs with
+    def create(self, shards: list, config: dict) -> None:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("DELETE FROM shards")
+            self.conn.executemany("INSERT INTO shards VALUES (?, ?, 'pending', NULL, 0, 0, NULL)",
+                                  [(i, json.dumps(ids)) for i, ids in enumerate(shards)])
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('config', ?)", (json.dumps(config),))
+            self.conn.execute("COMMIT")
+
+
+    # Config the queue was created with
+    def config(self) -> dict:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+        if row is None:
+            raise RuntimeError(f"Shard queue {self.path} has not been created by a coordinator")
+        return json.loads(row[0])
+
+
+    # Lease the next pending shard, or one whose worker stopped renewing its lease, as (id, question_ids)
+    def lease(self, worker: str) -> tuple:
+        with self.lock:
+            now = time.time()
+            self.conn.execute("BEGIN IMMEDIATE")
+            # Give up on shards that keep failing
+            self.conn.execute("""UPDATE shards SET status = 'failed'
+                                 WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?""", (now, self.max_attempts))
+            row = self.conn.execute("""SELECT id, question_ids FROM shards
+                                       WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)
+                                       ORDER BY id LIMIT 1""", (now,)).fetchone()
+            if row is not None:
+                self.conn.execute("""UPDATE shards SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1
+                                     WHERE id = ?""", (worker, now + self.lease_time, row[0]))
+            self.conn.execute("COMMIT")
+        return (row[0], json.loads(row[1])) if row is not None else None
+
+
+    # Extend a lease while the shard is still running
+    def renew(self, shard_id: int, worker: str) -> None:
+        with self.lock:
+            self.conn.execute("UPDATE shards SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                              (time.time() + self.lease_time, shard_id, worker))
+
+
+    # Mark a shard done with the path of its saved statistics, returning False if the worker no longer holds its lease
+    def complete(self, shard_id: int, worker: str, stats_path: str) -> bool:
+        with self.lock:
+            cursor = self.conn.execute("UPDATE shards SET status = 'done', stats_path = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                                       (stats_path, shard_id, worker))
+        return cursor.rowcount > 0
+
+
+    # Hand a shard back after a failure, or give up on it after too many attempts, returning False if the worker no longer holds its lease
+    def release(self, shard_id: int, worker: str) -> bool:
+        with self.lock:
+            cursor = self.conn.execute("""UPDATE shards SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, worker = NULL
+                                          WHERE id = ? AND worker = ? AND status = 'leased'""", (self.max_attempts, shard_id, worker))
+        return cursor.rowcount > 0
+
+
+    # Number of shards in each status
+    def progress(self) -> dict:
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+    # Check if every shard is done or failed
+    def finished(self) -> bool:
+        progress = self.progress()
+        return progress.get('pending', 0) == 0 and progress.get('leased', 0) == 0
+
+
+    # Saved statistics files of finished shards
+    def stats_paths(self) -> list:
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT stats_path FROM shards WHERE status = 'done' ORDER BY id")]
+
+
+# Split question ids into shards of a fixed size
+def make_shards(ids: list, shard_size: int) -> list:
+    shard_size = max(1, shard_size)
+    return [ids[i:i + shard_size] for i in range(0, len(ids), shard_size)]
+
+
+# Lease and run shards until the queue is finished
+def run_worker(queue_path: str, poll_interval: float=5) -> None:
+    # Run with the coordinator's config
+    queue = ShardQueue(queue_path)
+    config = queue.config()
+    queue.lease_time = config['shard_lease_time']
+    queue.max_attempts = config['shard_max_attempts']
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    worker_dir = os.path.join(config['shard_dir'], f"worker_{worker}") + os.sep
+    os.makedirs(worker_dir, exist_ok=True)
+    set_config({**config, 'output_path': worker_dir})
+    mad_community = importlib.import_module("MAD-Community")
+
+    while True:
+        leased = queue.lease(worker)
+        if leased is None:
+            if queue.finished():
+                break
+            # Wait for a shard of a worker that may have died
+            time.sleep(poll_interval)
+            continue
+        shard_id, ids = leased
+
+        # Renew the lease in the background so a long shard isn't reassigned
+        stop = threading.Event()
+        def heartbeat(stop: threading.Event, shard_id: int):
+            while not stop.wait(queue.lease_time / 3):
+                queue.renew(shard_id, worker)
+        threading.Thread(target=heartbeat, args=(stop, shard_id), daemon=True).start()
+
+        # Run the shard, resuming from its journal if an earlier worker died part way
+        try:
+            shard_path = os.path.join(config['shard_dir'], f"shard_{shard_id}")
+            ctx = RunContext({**config, 'output_path': worker_dir, 'journal_path': f"{shard_path}_journal.jsonl"})
+            stats = mad_community.MADCommunity(ctx, resume=True).run_dataset(desc=f"Shard {shard_id}", ids=ids, results_path=f"{shard_path}_results")
+            stats.save(f"{shard_path}_stats.json.tmp")
+            os.replace(f"{shard_path}_stats.json.tmp", f"{shard_path}_stats.json")
+            if not queue.complete(shard_id, worker, f"{shard_path}_stats.json"):
+                print(f"\nShard {shard_id} finished on {worker} after its lease was taken over, leaving it to the new worker\n")
+        except Exception as e:
+            print(f"\nShard {shard_id} failed on {worker} >> {e}\n")
+            if not queue.release(shard_id, worker):
+                print(f"\nShard {shard_id} was already taken over from {worker}\n")
+        finally:
+            stop.set()
+    collector.export()
+    tracer.export()
+
+
+# Split the run into shards, run them on local workers and merge the shard statistics
+def coordinate(ctx: RunContext, num_workers: int, resume: bool=False, poll_interval: float=5) -> StatsAggregator:
+    os.makedirs(ctx.shard_dir, exist_ok=True)
+    queue_path = os.path.join(ctx.shard_dir, "queue.sqlite")
+    queue = ShardQueue(queue_path, ctx.shard_lease_time, ctx.shard_max_attempts)
+
+    # Fill the queue with the selected questions unless resuming an earlier coordinator
+    if not resume:
+        mad_community = importlib.import_module("MAD-Community")
+        ids = mad_community.MADCommunity(ctx.with_overrides(journal_path="")).select_ids()
+        shards = make_shards(ids, ctx.shard_size)
+        queue.create(shards, ctx.config)
+        for shard_id in range(len(shards)):
+            for suffix in ["_journal.jsonl", "_stats.json", "_results.npz", "_results.reasons"]:
+                path = os.path.join(ctx.shard_dir, f"shard_{shard_id}{suffix}")
+                if os.path.exists(path):
+                    os.remove(path)
+    print(f"Shard queue at {queue_path}, add workers on other machines with: python shard.py work --queue {queue_path}")
+
+    # Keep local workers running until every shard is finished, replacing workers that die
+    command = [sys.executable, os.path.abspath(__file__), "work", "--queue", queue_path]
+    workers = [subprocess.Popen(command) for _ in range(num_workers)]
+    while not queue.finished():
+        time.sleep(poll_interval)
+        for i, process in enumerate(workers):
+            if process.poll() is not None and not queue.finished():
+                print(f"\nWorker {process.pid} exited with code {process.returncode}, starting a new worker\n")
+                workers[i] = subprocess.Popen(command)
+    for process in workers:
+        process.wait()
+
+    # Merge shard statistics
+    failed = queue.progress().get('failed', 0)
+    if failed:
+        print(f"\n{failed} shards failed after {ctx.shard_max_attempts} attempts and are left out of the statistics\n")
+    stats = StatsAggregator(ctx.topology)
+    for path in queue.stats_paths():
+        stats.merge(StatsAggregator.load(path, ctx.topology))
+    return stats
+
+
+# Run the coordinator or a worker from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded MAD-Community runs over worker processes and machines")
+    commands = parser.add_subparsers(dest="command", required=True)
+    coordinator = commands.add_parser("coordinate", help="split the run into shards, run local workers and merge the statistics")
+    coordinator.add_argument("--workers", type=int, default=os.cpu_count())
+    coordinator.add_argument("--resume", action="store_true", help="keep the shard queue of an earlier coordinator")
+    coordinator.add_argument("--config", help="config file to use instead of config/_config.json or MAD_CONFIG")
+    coordinator.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                             help="override a config value, parsed as JSON")
+    worker = commands.add_parser("work", help="run shards from a coordinator's queue until it is finished")
+    worker.add_argument("--queue", required=True, help="path of the coordinator's queue.sqlite")
+    args = parser.parse_args()
+
+    if args.command == "work":
+        run_worker(args.queue)
+    else:
+        try:
+            ctx = RunContext.from_file(args.config, args.overrides)
+            ctx.topology
+        except ValueError as e:
+            parser.error(str(e))
+        stats = coordinate(ctx, args.workers, args.resume)
+        stats.write_report(ctx)
@@ -1,82 +1,163 @@
-from config_loader import load_config, load_network_config
+import json
+from topology import NetworkTopology
+from scheduler import get_scheduler
 from datetime import datetime
-config = load_config()
-test_mode = config['test_mode']
-save_stats = config['save_stats']
-output_path = config['output_path']
-network_preset = config['network_preset']
-num_questions = config['num_questions']
-num_agents = config['num_agents']
-num_rounds = config['num_rounds']
-
-
-# Calculate and dump MAD-Community statistics to JSON file
-def get_statistics(response_stats: list) -> None:
-    # Check if test mode is enabled
-    if test_mode and not save_stats:
-        return
-    
-    # Get network parameters
-    _, matrix, temp_list = load_network_config(network_preset)
-    num_communities = len(matrix)
-    total_agent_responses = num_questions * num_communities * num_agents * num_rounds
-    stats = {
-                'Judge_Score': 0,
-                'Community_Score': [0] * num_communities,
-                'Agents_Score': 0
-            }
-
-    # Iterate through each question and calculate scores
-    for question in response_stats:
+
+
+# Percent of correct answers rounded like the stats report
+def percent(score: int, total: int) -> float:
+    return round(100 * round(score / total, 3), 1) if total else 0.0
+
+
+# Running MAD-Community statistics updated one question at a time
+class StatsAggregator:
+    def __init__(self, topology: NetworkTopology):
+        self.temperatures = topology.temperatures
+        self.num_communities = topology.num_communities
+        self.num_upstream = [len(topology.listeners[i]) for i in range(self.num_communities)]
+        self.num_questions = 0
+        self.judge_score = 0
+        self.community_score = [0] * self.num_communities
+        self.agents_score = 0
+        self.agents_total = 0
+        self.agent_scores = {}
+        self.skipped_calls = 0
+
+
+    # Add one question's responses without modifying them
+    def add(self, correct_answer: int, all_responses: list) -> None:
+        self.num_questions += 1
+
         # Calculate judge score
-        correct_answer = question['correct_answer']
-        all_responses = question['all_responses']
-        judge_answer = all_responses.pop()['Answer']
-        stats['Judge_Score'] += 1 if judge_answer == correct_answer else 0
+        judge_answer = all_responses[-1]['Answer']
+        self.judge_score += 1 if judge_answer == correct_answer else 0
+        self.skipped_calls += 1 if all_responses[-1].get('Skipped') else 0
 
         # Calculate community and agent scores
-        for i, com_chat_hist in enumerate(all_responses):
-            # Calculate community score
-            com_answer = com_chat_hist.pop()['Answer']
-            stats['Community_Score'][i] += 1 if com_answer == correct_answer else 0
-
-            # Calculate agent score
-            for agent in com_chat_hist:
-                if 'Previous Response' not in agent['Name']:
-                    stats['Agents_Score'] += 1 if agent['Answer'] == correct_answer else 0
-
-    # Calculate percentages
-    stats['Judge_Percent'] = round(100 * round(stats['Judge_Score'] / num_questions, 3), 1)
-    stats['Community_Percent'] = [round(100 * round(score / num_questions, 3), 1) for score in stats['Community_Score']]
-    stats['Agents_Percent'] = round(100 * round(stats['Agents_Score'] / total_agent_responses, 2), 1)
-
-    # Set file name based on test mode and timestamp
-    current_time = datetime.now().strftime("%m-%d,%H%M")
-    if test_mode:
-        file_name = f"test_stats/{current_time}.txt"
-    elif save_stats:
-        file_name = f"stats_save/stats_{current_time}.txt"
-    else:
-        file_name = "stats.txt"
-
-    # Save statistics to JSON file
-    with open(f"{output_path}{file_name}", 'w') as f:
-        f.write("MAD-Community Statistics\n")
-        f.write(f"Timestamp: {current_time}\n" if save_stats else "")
-        f.write("=========================\n\n")
-
-        if network_preset > 0:
-            f.write(f"Network Preset: {network_preset}\n")
-
-        f.write(f"Number of questions: {num_questions}\n")
-        f.write(f"Number of communities: {num_communities}\n")
-        f.write(f"Number of agents: {num_agents}\n")
-        f.write(f"Number of rounds: {num_rounds}\n\n")
-
-        f.write("Community {Temp} Scores\n")
-        for i, percent in enumerate(stats['Community_Percent']):
-            f.write(f"\tCommunity {i+1} {{{temp_list[i]}}}: {percent}% correct ({stats['Community_Score'][i]}/{num_questions})\n")
-        f.write(f"Agents Score: {stats['Agents_Percent']}% correct\n")
-        f.write(f"\n[Final Result]\nJudge Score: {stats['Judge_Percent']}% correct ({stats['Judge_Score']}/{num_questions})\n\n")
-
-    return
\ No newline at end of file
+        for i, com_chat_hist in enumerate(all_responses[:-1]):
+            com_answer = com_chat_hist[-1]['Answer']
+            self.community_score[i] += 1 if com_answer == correct_answer else 0
+            self.skipped_calls += 1 if com_chat_hist[-1].get('Skipped') else 0
+
+            # Skip upstream community answers at the start and the community judge at the end
+            for agent in com_chat_hist[self.num_upstream[i]:-1]:
+                correct = 1 if agent['Answer'] == correct_answer else 0
+                self.agents_score += correct
+                self.agents_total += 1
+                agent_score = self.agent_scores.setdefault(agent['Name'], [0, 0])
+                agent_score[0] += correct
+                agent_score[1] += 1
+                self.skipped_calls += 1 if agent.get('Skipped') else 0
+
+
+    # Merge statistics from another aggregator over the same network
+    def merge(self, other: 'StatsAggregator') -> None:
+        self.num_questions += other.num_questions
+        self.judge_score += other.judge_score
+        self.community_score = [a + b for a, b in zip(self.community_score, other.community_score)]
+        self.agents_score += other.agents_score
+        self.agents_total += other.agents_total
+        self.skipped_calls += other.skipped_calls
+        for name, (score, total) in other.agent_scores.items():
+            agent_score = self.agent_scores.setdefault(name, [0, 0])
+            agent_score[0] += score
+            agent_score[1] += total
+
+
+    # Current scores and percentages
+    def summary(self) -> dict:
+        return {
+            'Questions': self.num_questions,
+            'Judge_Score': self.judge_score,
+            'Judge_Percent': percent(self.judge_score, self.num_questions),
+            'Community_Score': self.community_score,
+            'Community_Percent': [percent(score, self.num_questions) for score in self.community_score],
+            'Agents_Score': self.agents_score,
+            'Agents_Percent': percent(self.agents_score, self.agents_total),
+            'Agent_Percent': {name: percent(score, total) for name, (score, total) in sorted(self.agent_scores.items())},
+            'Skipped_Calls': self.skipped_calls
+        }
+
+
+    # Save raw counters so aggregates from separate shards can be merged
+    def save(self, path: str) -> None:
+        counters = {
+            'num_questions': self.num_questions,
+            'judge_score': self.judge_score,
+            'community_score': self.community_score,
+            'agents_score': self.agents_score,
+            'agents_total': self.agents_total,
+            'agent_scores': self.agent_scores,
+            'skipped_calls': self.skipped_calls
+        }
+        with open(path, 'w') as f:
+            json.dump(counters, f, indent=4)
+
+
+    # Load raw counters saved by another aggregator over the same network
+    @classmethod
+    def load(cls, path: str, topology: NetworkTopology) -> 'StatsAggregator':
+        aggregator = cls(topology)
+        with open(path, 'r') as f:
+            counters = json.load(f)
+        aggregator.num_questions = counters['num_questions']
+        aggregator.judge_score = counters['judge_score']
+        aggregator.community_score = counters['community_score']
+        aggregator.agents_score = counters['agents_score']
+        aggregator.agents_total = counters['agents_total']
+        aggregator.agent_scores = counters['agent_scores']
+        aggregator.skipped_calls = counters['skipped_calls']
+        return aggregator
+
+
+    # Write statistics report of a run to a text file, named by test mode and timestamp unless a path is given
+    def write_report(self, ctx, path: str=None) -> None:
+        # Check if test mode is enabled
+        if path is None and ctx.test_mode and not ctx.save_stats:
+            return
+        stats = self.summary()
+
+        # Set file name based on test mode and timestamp
+        current_time = datetime.now().strftime("%m-%d,%H%M")
+        if path is not None:
+            file_name = path
+        elif ctx.test_mode:
+            file_name = f"{ctx.output_path}test_stats/{current_time}.txt"
+        elif ctx.save_stats:
+            file_name = f"{ctx.output_path}stats_save/stats_{current_time}.txt"
+        else:
+            file_name = f"{ctx.output_path}stats.txt"
+
+        # Save statistics to text file
+        with open(file_name, 'w') as f:
+            f.write("MAD-Community Statistics\n")
+            f.write(f"Timestamp: {current_time}\n" if ctx.save_stats else "")
+            f.write("=========================\n\n")
+
+            if ctx.network_preset > 0:
+                f.write(f"Network Preset: {ctx.network_preset}\n")
+            if ctx.community_temperature is not None:
+                f.write(f"Community Temperature: {ctx.community_temperature}\n")
+
+            f.write(f"Number of questions: {self.num_questions}\n")
+            f.write(f"Number of communities: {self.num_communities}\n")
+            f.write(f"Number of agents: {ctx.num_agents}\n")
+            f.write(f"Number of rounds: {ctx.num_rounds}\n\n")
+
+            f.write("Community {Temp} Scores\n")
+            for i, com_percent in enumerate(stats['Community_Percent']):
+                f.write(f"\tCommunity {i+1} {{{self.temperatures[i]}}}: {com_percent}% correct ({stats['Community_Score'][i]}/{self.num_questions})\n")
+            f.write(f"Agents Score: {stats['Agents_Percent']}% correct\n")
+            for name, agent_percent in stats['Agent_Percent'].items():
+                f.write(f"\t{name}: {agent_percent}% correct\n")
+            if self.skipped_calls:
+                f.write(f"Skipped Calls: {self.skipped_calls} agent and judge calls skipped on consensus\n")
+            if ctx.history_strategy != "full":
+                f.write(f"History Strategy: {ctx.history_strategy} saved ~{ctx.history_savings.saved()} of {ctx.history_savings.full_tokens} history tokens over {ctx.history_savings.prompts} prompts\n")
+            scheduler = get_scheduler()
+            if scheduler is not None and ctx.slot_usage.calls:
+                slots = scheduler.stats(ctx.slot_usage)
+                f.write(f"Call Scheduler: {slots['slots']} slots {round(100 * slots['utilization'], 1)}% utilized, "
+                        f"queue depth mean {slots['mean_queue_depth']} max {slots['max_queue_depth']}, "
+                        f"{slots['queued_calls']}/{slots['calls']} calls queued for {slots['mean_wait']}s on average\n")
+            f.write(f"\n[Final Result]\nJudge Score: {stats['Judge_Percent']}% correct ({stats['Judge_Score']}/{self.num_questions})\n\n")
@@ -0,0 +1,173 @@
+import argparse
+import importlib
+import itertools
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from run_context import RunContext
+from config_loader import PROCESS_KEYS
+from metrics import collector, note_cache_hit
+from tracer import tracer
+
+
+# Runs each distinct LLM call of a sweep once and hands its result to every config that makes it
+class SharedCalls:
+    def __init__(self):
+        self.calls = {}
+        self.requests = 0
+        self.made = 0
+        self.hits = 0
+        self.lock = threading.Lock()
+
+
+    # Get the result of a call, computing it only if no other config has made or is making it
+    def call(self, key: str, compute) -> object:
+        with self.lock:
+            self.requests += 1
+            future = self.calls.get(key)
+            owner = future is None
+            if owner:
+                future = self.calls[key] = Future()
+                self.made += 1
+        if not owner:
+            result = future.result()
+            with self.lock:
+                self.hits += 1
+            note_cache_hit()
+            return result
+
+        # Compute the call, forgetting it on failure so a later request can try again
+        try:
+            result = compute()
+        except BaseException as e:
+            with self.lock:
+                del self.calls[key]
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+
+    # Number of requests answered by another config's successful call
+    def shared(self) -> int:
+        return self.hits
+
+
+# Parse KEY=V1,V2,... grid axes into (key, values) pairs with values parsed as JSON
+def parse_grid(axes: list) -> list:
+    grid = []
+    for axis in axes:
+        key, sep, values = axis.partition("=")
+        if not sep or not values:
+            raise ValueError(f"Grid axis '{axis}' should look like KEY=V1,V2,...")
+        parsed = []
+        for value in values.split(","):
+            try:
+                parsed.append(json.loads(value))
+            except json.JSONDecodeError:
+                parsed.append(value)
+        grid.append((key, parsed))
+    return grid
+
+
+# Config overrides of every point of the grid
+def grid_points(grid: list) -> list:
+    keys = [key for key, _ in grid]
+    return [dict(zip(keys, values)) for values in itertools.product(*(values for _, values in grid))]
+
+
+# Label of a grid point used in file names and the comparison table
+def point_label(point: dict) -> str:
+    return ",".join(f"{key}={value}" for key, value in point.items())
+
+
+# Run every config of a grid together, sharing identical calls between them
+class Sweep:
+    def __init__(self, base: RunContext, grid: list):
+        self.base = base
+        self.points = grid_points(grid)
+        self.shared_calls = SharedCalls()
+
+        # Only keys of a run's own context can differ between configs
+        keys = [key for key, _ in grid]
+        unknown = [key for key in keys if key not in base.config]
+        if unknown:
+            raise ValueError(f"Unknown config keys in grid: {unknown}")
+        process_wide = [key for key in keys if key in PROCESS_KEYS]
+        if process_wide:
+            raise ValueError(f"Config keys {process_wide} apply to every config of a sweep and can't be swept, set them with --set")
+
+        # Parse each config's network so an invalid one fails before anything is written
+        for point in self.points:
+            base.with_overrides(**point).topology
+        self.sweep_dir = os.path.join(base.output_path, f"sweep_{datetime.now().strftime('%m-%d,%H%M')}")
+        os.makedirs(self.sweep_dir, exist_ok=True)
+
+        # Config per point, each with its own output directory and no journal
+        self.contexts = []
+        for point in self.points:
+            output_path = os.path.join(self.sweep_dir, point_label(point)) + os.sep
+            os.makedirs(output_path, exist_ok=True)
+            ctx = base.with_overrides(**point, output_path=output_path, journal_path="")
+            ctx.shared_calls = self.shared_calls
+
+            self.contexts.append(ctx)
+
+
+    # Run one config and write its stats report
+    def run_config(self, i: int) -> dict:
+        mad_community = importlib.import_module("MAD-Community")
+        ctx = self.contexts[i]
+        stats = mad_community.MADCommunity(ctx).run_dataset(desc=point_label(self.points[i]))
+        stats.write_report(ctx, f"{ctx.output_path}stats.txt")
+        return stats.summary()
+
+
+    # Run every config at once so shared calls are only made by whichever config gets there first
+    def run(self) -> list:
+        with ThreadPoolExecutor(max_workers=len(self.contexts)) as executor:
+            summaries = list(executor.map(self.run_config, range(len(self.contexts))))
+        self.write_comparison(summaries)
+        return summaries
+
+
+    # Write a table comparing the configs
+    def write_comparison(self, summaries: list) -> None:
+        labels = [point_label(point) for point in self.points]
+        width = max(len("Config"), *(len(label) for label in labels))
+        lines = [f"{'Config':<{width}} {'Questions':>9} {'Judge %':>8} {'Agents %':>9} {'Best Com %':>10} {'Skipped':>8}"]
+        for label, summary in zip(labels, summaries):
+            best_community = max(summary['Community_Percent'], default=0.0)
+            lines.append(f"{label:<{width}} {summary['Questions']:>9} {summary['Judge_Percent']:>8} "
+                         f"{summary['Agents_Percent']:>9} {best_community:>10} {summary['Skipped_Calls']:>8}")
+        lines.append("")
+        lines.append(f"LLM calls: {self.shared_calls.requests} requested, {self.shared_calls.made} made, "
+                     f"{self.shared_calls.shared()} shared across configs")
+        table = "\n".join(lines) + "\n"
+
+        print("\n" + table)
+        with open(os.path.join(self.sweep_dir, "comparison.txt"), 'w') as f:
+            f.write(table)
+        with open(os.path.join(self.sweep_dir, "comparison.json"), 'w') as f:
+            json.dump([{**point, **summary} for point, summary in zip(self.points, summaries)], f, indent=4)
+
+
+# Run a sweep from the command line
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a grid of MAD-Community configs, sharing identical LLM calls between them")
+    parser.add_argument("--grid", action="append", required=True, metavar="KEY=V1,V2,...",
+                        help="config values to sweep, parsed as JSON, e.g. network_preset=1,2,3")
+    parser.add_argument("--config", help="base config file to use instead of config/_config.json or MAD_CONFIG")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a base config value, parsed as JSON")
+    args = parser.parse_args()
+
+    try:
+        sweep = Sweep(RunContext.from_file(args.config, args.overrides), parse_grid(args.grid))
+    except ValueError as e:
+        parser.error(str(e))
+    sweep.run()
+    collector.export()
+    tracer.export()
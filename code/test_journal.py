@@ -0,0 +1,72 @@
+import csv
+import importlib
+import json
+import pytest
+from journal import load_journal
+from run_context import RunContext
+
+mad_community = importlib.import_module("MAD-Community")
+
+
+# Write a small GPQA style dataset
+def write_dataset(path, num_questions: int) -> None:
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Pre-Revision Question", "Question", "Correct Answer", "Incorrect Answer 1", "Incorrect Answer 2",
+                         "Incorrect Answer 3", "Record ID", "Canary String"])
+        for i in range(num_questions):
+            writer.writerow([f"pre {i}", f"What is {i} + 1?", str(i + 1), str(i + 2), str(i + 3), str(i), f"rec{i}", ""])
+
+
+# Run context answering from the mock backend with nothing but the journal written
+@pytest.fixture
+def ctx(tmp_path):
+    write_dataset(tmp_path / "questions.csv", 6)
+    return RunContext.from_file(overrides=[
+        "llm_backend=mock", "execution_mode=interactive", "network_preset=3", "question_start=0", "num_questions=6",
+        f"dataset_path={tmp_path / 'questions.csv'}", f"output_path={tmp_path}/", f"journal_path={tmp_path / 'journal.jsonl'}",
+        "save_results=false", "metrics=false", "trace=false", "cache_mode=off", "test_mode=false"])
+
+
+# Node and judge records of each row of a journal
+def row_results(path: str) -> dict:
+    return {row: (progress['nodes'], progress['judge']) for row, progress in load_journal(path).items()}
+
+
+# Resume from a copy of the full journal cut down by keep, and check every row ends up as in the full run
+def resume_from(ctx, tmp_path, keep) -> None:
+    full = mad_community.MADCommunity(ctx).run_dataset()
+    with open(ctx.journal_path, 'r') as f:
+        lines = f.readlines()
+    resumed_path = str(tmp_path / "resumed.jsonl")
+    with open(resumed_path, 'w') as f:
+        f.write(keep(lines))
+
+    resumed_ctx = ctx.with_overrides(journal_path=resumed_path)
+    resumed = mad_community.MADCommunity(resumed_ctx, resume=True).run_dataset()
+    assert row_results(resumed_path) == row_results(ctx.journal_path)
+    assert resumed.summary() == full.summary()
+
+
+# A journal cut off part way through a record resumes to the same results
+def test_resume_truncated_journal(ctx, tmp_path):
+    resume_from(ctx, tmp_path, lambda lines: "".join(lines)[:len("".join(lines)) // 2])
+
+
+# A journal holding downstream communities without their senders resumes to the same results
+def test_resume_journal_missing_upstream_communities(ctx, tmp_path):
+    starting = [i for i, start in enumerate(ctx.topology.starting) if start == 1]
+
+    # Drop every judge verdict and the records of the starting communities
+    def keep(lines):
+        records = [json.loads(line) for line in lines]
+        return "".join(json.dumps(record) + "\n" for record in records
+                       if record['type'] != "judge" and not (record['type'] == "node" and record['node'] in starting))
+    resume_from(ctx, tmp_path, keep)
+
+
+# Resuming under a different network is refused
+def test_resume_refuses_other_config(ctx):
+    mad_community.MADCommunity(ctx).run_dataset()
+    with pytest.raises(ValueError, match="different config"):
+        mad_community.MADCommunity(ctx.with_overrides(network_preset=1), resume=True)
@@ -0,0 +1,30 @@
+from resilience import RetryBudget, get_retry_budget, retry_budget_giveup
+
+
+# Successes earn back spent retries only by the ratio, never past the starting budget
+def test_retry_budget_earns_ratio_per_success():
+    budget = RetryBudget(ratio=0.2, minimum=2)
+    assert budget.acquire() and budget.acquire()
+    assert not budget.acquire()
+
+    for _ in range(4):
+        budget.record_success()
+    assert not budget.acquire()
+    budget.record_success()
+    assert budget.acquire()
+    assert not budget.acquire()
+
+    for _ in range(100):
+        budget.record_success()
+    assert [budget.acquire() for _ in range(3)] == [True, True, False]
+
+
+# The giveup check spends a retry only when backoff would try again
+def test_retry_budget_giveup_spends_only_on_retries():
+    budget = get_retry_budget()
+    tokens = budget.tokens
+    giveup = retry_budget_giveup(max_tries=2, max_time=60)
+    assert not giveup(ValueError())
+    assert budget.tokens == tokens - 1
+    assert giveup(ValueError())
+    assert budget.tokens == tokens - 1
@@ -0,0 +1,26 @@
+from response_cache import ResponseCache
+
+
+# Key of a request to the cache
+def key(sample_index: int, node_name: str="Community 1") -> str:
+    return ResponseCache.make_key("gpt-4o-mini", 0.7, node_name, sample_index, [{"role": "user", "content": "Question"}])
+
+
+# Recorded responses are replayed from disk by a later cache
+def test_record_then_replay(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    ResponseCache(path, "record", 0, 0).put(key(0), "gpt-4o-mini", {"answer": 2, "reason": "Because"})
+    replay = ResponseCache(path, "replay", 0, 0)
+    assert replay.get(key(0)) == {"answer": 2, "reason": "Because"}
+    assert replay.get(key(1)) is None
+    assert replay.get(key(0, "Community 2")) is None
+
+
+# Least recently used responses are evicted past the max size
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), "read-through", 2, 0)
+    for i in range(3):
+        cache.put(key(i), "gpt-4o-mini", {"answer": 1, "reason": f"Reason {i}"})
+    cache.get(key(0))
+    cache.evict()
+    assert [cache.get(key(i)) is not None for i in range(3)] == [True, False, True]
@@ -0,0 +1,29 @@
+from shard import ShardQueue, make_shards
+
+
+# Fill a queue whose leases expire right away so another worker can take over
+def expired_queue(tmp_path) -> ShardQueue:
+    queue = ShardQueue(str(tmp_path / "queue.sqlite"), lease_time=0, max_attempts=3)
+    queue.create(make_shards([1, 2, 3], 2), {})
+    return queue
+
+
+# Only the worker holding a shard's lease can complete it
+def test_complete_requires_lease(tmp_path):
+    queue = expired_queue(tmp_path)
+    assert queue.lease("a") == (0, [1, 2])
+    assert queue.lease("b") == (0, [1, 2])
+    assert not queue.complete(0, "a", "a_stats.json")
+    assert queue.complete(0, "b", "b_stats.json")
+    assert queue.stats_paths() == ["b_stats.json"]
+
+
+# A worker that lost its lease can't hand the shard back while another worker runs it
+def test_release_requires_lease(tmp_path):
+    queue = expired_queue(tmp_path)
+    queue.lease("a")
+    queue.lease("b")
+    assert not queue.release(0, "a")
+    assert queue.progress() == {'leased': 1, 'pending': 1}
+    assert queue.release(0, "b")
+    assert queue.progress() == {'pending': 2}
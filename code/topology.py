@@ -0,0 +1,127 @@
+from config_loader import load_network_config, load_preset_numbers
+
+
+# Raised when a network config cannot be run
+class NetworkConfigError(ValueError):
+    pass
+
+
+# Network config parsed and validated once per run
+class NetworkTopology:
+    def __init__(self, starting: list, matrix: list, temp_list: list):
+        self.starting = starting
+        self.matrix = matrix
+        self.temperatures = temp_list
+        self.num_communities = len(temp_list)
+        self.judge_index = self.num_communities
+        self.validate_shape()
+
+        # Adjacency lists, with the judge as the last node
+        self.senders = [[to_node for to_node, val in enumerate(row) if val == 1 and to_node != from_node]
+                        for from_node, row in enumerate(matrix)]
+        self.listeners = [[] for _ in range(self.num_communities + 1)]
+        for from_node, to_nodes in enumerate(self.senders):
+            for to_node in to_nodes:
+                self.listeners[to_node].append(from_node)
+        self.start_nodes = [i for i, val in enumerate(starting) if val == 1]
+
+        # Compile schedule
+        self.order = self.topological_order()
+        self.validate_reachability()
+        self.levels = self.level_schedule()
+        self.critical_path_length = len(self.levels)
+        self.remaining_depth = self.depth_to_judge()
+
+
+    # Parse and compile a network preset
+    @classmethod
+    def from_preset(cls, network_preset: int) -> 'NetworkTopology':
+        presets = load_preset_numbers()
+        if network_preset != 0 and network_preset not in presets:
+            raise NetworkConfigError(f"Unknown network preset {network_preset}, expected 0 for network_config.txt or one of {presets}.")
+        starting, matrix, temp_list = load_network_config(network_preset)
+        return cls(starting, matrix, temp_list)
+
+
+    # Check that the matrix, starting row and temperatures agree in size
+    def validate_shape(self) -> None:
+        n = self.num_communities
+        if n == 0:
+            raise NetworkConfigError("Network config has no community temperatures.")
+        if len(self.matrix) != n:
+            raise NetworkConfigError(f"Network matrix has {len(self.matrix)} rows but {n} temperatures are set.")
+        if len(self.starting) != n:
+            raise NetworkConfigError(f"Qn row has {len(self.starting)} entries but {n} temperatures are set.")
+        for i, row in enumerate(self.matrix):
+            if len(row) != n + 1:
+                raise NetworkConfigError(f"Row C{i+1} has {len(row)} entries, expected {n + 1} (communities and J).")
+        if any(val not in (0, 1) for row in [self.starting] + self.matrix for val in row):
+            raise NetworkConfigError("Network config entries must be 0 or 1.")
+
+
+    # Order communities so every node comes after its listeners, failing on cycles
+    def topological_order(self) -> list:
+        in_degree = [len(self.listeners[i]) for i in range(self.num_communities)]
+        order = [i for i in range(self.num_communities) if in_degree[i] == 0]
+        for node in order:
+            for to_node in self.senders[node]:
+                if to_node == self.judge_index:
+                    continue
+                in_degree[to_node] -= 1
+                if in_degree[to_node] == 0:
+                    order.append(to_node)
+
+        if len(order) != self.num_communities:
+            cycle = [f"C{i+1}" for i in range(self.num_communities) if i not in order]
+            raise NetworkConfigError(f"Network has a cycle through {', '.join(cycle)}.")
+        return order
+
+
+    # Check every community is reachable from Qn and reaches J
+    def validate_reachability(self) -> None:
+        if not self.start_nodes:
+            raise NetworkConfigError("No starting communities are marked in the Qn row.")
+        if not self.listeners[self.judge_index]:
+            raise NetworkConfigError("No communities send to the judge column J.")
+        for i in self.start_nodes:
+            if self.listeners[i]:
+                raise NetworkConfigError(f"Starting community C{i+1} also receives from other communities.")
+
+        # Walk forward from Qn
+        reached = set(self.start_nodes)
+        for node in self.order:
+            if node in reached:
+                reached.update(to_node for to_node in self.senders[node] if to_node != self.judge_index)
+        unreachable = [f"C{i+1}" for i in range(self.num_communities) if i not in reached]
+        if unreachable:
+            raise NetworkConfigError(f"Communities not reachable from Qn: {', '.join(unreachable)}.")
+
+        # Walk backward from J
+        reaches_judge = set()
+        for node in reversed(self.order):
+            if any(to_node == self.judge_index or to_node in reaches_judge for to_node in self.senders[node]):
+                reaches_judge.add(node)
+        dead_ends = [f"C{i+1}" for i in range(self.num_communities) if i not in reaches_judge]
+        if dead_ends:
+            raise NetworkConfigError(f"Communities that never reach J: {', '.join(dead_ends)}.")
+
+
+    # Group communities into levels that can run at the same time
+    def level_schedule(self) -> list:
+        level = [0] * self.num_communities
+        for node in self.order:
+            if self.listeners[node]:
+                level[node] = 1 + max(level[from_node] for from_node in self.listeners[node])
+        levels = [[] for _ in range(max(level) + 1)]
+        for node in range(self.num_communities):
+            levels[level[node]].append(node)
+        return levels
+
+
+    # Count communities left on the longest path from each community to J, including itself
+    def depth_to_judge(self) -> list:
+        depth = [0] * self.num_communities
+        for node in reversed(self.order):
+            downstream = [depth[to_node] for to_node in self.senders[node] if to_node != self.judge_index]
+            depth[node] = 1 + max(downstream, default=0)
+        return depth
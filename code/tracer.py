@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from config_loader import load_config
+
+# Span returned while tracing is off
+_no_span = nullcontext()
+
+# Thread id offset of the critical path tracks
+CRITICAL_PATH_TID = 1_000_000_000
+
+
+# Records spans of a run and writes them in the Chrome trace event format
+class Tracer:
+    def __init__(self):
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.run_time = datetime.now().strftime("%m-%d,%H%M")
+
+
+    # Time the body of a with block as a span
+    @contextmanager
+    def span(self, name: str, args: dict):
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            # Keep the error on the span so failed attempts and queries stand out
+            args = {**args, "error": type(e).__name__}
+            raise
+        finally:
+            self.record(name, start, time.perf_counter(), args)
+
+
+    # Add a complete event for a span of the current thread
+    def record(self, name: str, start: float, end: float, args: dict) -> None:
+        thread = threading.current_thread()
+        event = {"name": name, "ph": "X", "ts": round((start - self.started) * 1e6, 1), "dur": round((end - start) * 1e6, 1),
+                 "pid": os.getpid(), "tid": thread.ident, "args": args}
+        with self.lock:
+            self.events.append(event)
+            self.threads.setdefault(thread.ident, thread.name)
+
+
+    # Mark the spans that set each network's wall time and copy them onto a critical path track per network
+    def critical_path(self, events: list) -> list:
+        networks = {}
+        for event in events:
+            if event['args'].get('network') is not None:
+                networks.setdefault(event['args']['network'], []).append(event)
+
+        track_events = []
+        for seq, network_events in sorted(networks.items()):
+            # Walk back from the judge through the latest finishing node each node listened to
+            nodes = {event['args']['community']: event for event in network_events if event['name'] in ["run_community", "run_judge"]}
+            if 'Judge' not in nodes:
+                continue
+            path = [nodes['Judge']]
+            while True:
+                senders = [nodes[name] for name in path[-1]['args'].get('after', []) if name in nodes]
+                if not senders:
+                    break
+                path.append(max(senders, key=lambda event: event['ts'] + event['dur']))
+            path.reverse()
+
+            # The slowest ask of each round of a node on the path held up the round
+            critical = list(path)
+            for node in path:
+                rounds = {}
+                for event in network_events:
+                    if event['name'] == "ask" and event['args']['community'] == node['args']['community']:
+                        slowest = rounds.get(event['args']['round'])
+                        if slowest is None or event['ts'] + event['dur'] > slowest['ts'] + slowest['dur']:
+                            rounds[event['args']['round']] = event
+                critical.extend(rounds.values())
+            critical.extend(event for event in network_events if event['name'] == "round" and event['args']['community'] in
+                            [node['args']['community'] for node in path])
+
+            # Copy the path onto its own track, with the time each node waited after its last sender finished
+            tid = CRITICAL_PATH_TID + seq
+            question = path[-1]['args'].get('question')
+            track_events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                                 "args": {"name": f"Critical path, question {question} (network {seq})"}})
+            for event in critical:
+                event['args']['critical_path'] = True
+                track_events.append({**event, "tid": tid})
+            for sender, node in zip(path, path[1:]):
+                wait = node['ts'] - (sender['ts'] + sender['dur'])
+                if wait > 0:
+                    track_events.append({"name": "waiting", "ph": "X", "ts": sender['ts'] + sender['dur'], "dur": round(wait, 1),
+                                         "pid": os.getpid(), "tid": tid,
+                                         "args": {"community": node['args']['community'], "after": sender['args']['community']}})
+        return track_events
+
+
+    # Write the run's spans to a trace file Perfetto and chrome://tracing can open, then start a new trace
+    def export(self) -> None:
+        with self.lock:
+            events, threads = self.events, self.threads
+            self.events, self.threads = [], {}
+        if not events:
+            return
+
+        metadata = [{"name": "process_name", "ph": "M", "pid": os.getpid(), "tid": 0, "args": {"name": "MAD-Community"}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                     for tid, name in threads.items()]
+        track_events = self.critical_path(events)
+        with open(f"{load_config()['output_path']}trace_{self.run_time}.json", 'w') as f:
+            json.dump({"traceEvents": metadata + events + track_events, "displayTimeUnit": "ms"}, f)
+
+
+tracer = Tracer()
+
+
+# Span of the run's trace, or a shared no-op if tracing is off
+def span(name: str, **args):
+    if not load_config()['trace']:
+        return _no_span
+    return tracer.span(name, args)